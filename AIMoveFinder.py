@@ -1,9 +1,55 @@
 import random
+import time
+import ShogiEngine
+from TranspositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+from MoveOrdering import MoveOrderer
+from OpeningBook import OpeningBook
+from SearchStats import SearchStats, makeProfiler
 
-pieceScores = {'K': 0, 'O': 15, 'H': 15, 'R': 10, 'B': 10, 'G': 5, 'S': 5, 'N': 3, 'L': 2, 'p': 1}
+pieceScores = ShogiEngine.pieceScores     #Material is kept up to date by the engine, see GameState.material
+codeScores = ShogiEngine.codeScores
+#Most a capture of every piece code adds to the material: the piece leaves the board and goes unpromoted into the hand
+captureGains = [abs(codeScores[code]) + codeScores[ShogiEngine.handTypes[code]] for code in range(len(codeScores))]
 checkMate = 1000
 staleMate = 0
-DEPTH = 2
+sennichite = 0      #Score of a repeated position
+perpetualCheck = checkMate - 1      #Score of a repetition the opponent forced by checking on every move, the checker loses
+DEPTH = 2       #Depth used by the GUI
+MAX_DEPTH = 64  #Deepest iteration of search() when only a time limit is given
+NODES_PER_TIME_CHECK = 256  #How often the clock is read
+QUIESCENCE_NODE_LIMIT = 200000  #Capture search nodes allowed per search, the leaves stand pat once they are used up
+DELTA_MARGIN = 2    #Slack of delta pruning, a capture must be able to lift the score to within this of alpha
+PROMOTION_GAIN = 5  #Most a promotion adds to the material score (Bishop to promoted Bishop)
+SCOUT_WINDOW = 1    #Width of the zero windows, material scores are whole numbers
+NULL_MOVE_REDUCTION = 2     #Plies the search after a passed turn is shallower than the node
+NULL_MOVE_MIN_DEPTH = 3     #Shallowest node that tries passing
+LMR_MIN_DEPTH = 3   #Shallowest node that reduces late moves
+LMR_FULL_MOVES = 3  #Moves searched at full depth before the reductions start
+LMR_REDUCTION = 1   #Plies a late move is reduced by
+#Switchable parts of the search by name, as Searcher options
+SEARCH_FEATURES = {'pvs': 'pvs', 'null-move': 'nullMove', 'lmr': 'lateMoveReductions'}
+
+transpositionTable = TranspositionTable()   #Shared by every search, so positions seen in earlier moves are reused
+openingBook = None      #Consulted before every search when set
+
+'''
+Replace the transposition table by an empty one using about sizeMb megabytes
+'''
+def setHashSize(sizeMb):
+    global transpositionTable
+    transpositionTable = TranspositionTable(sizeMb)
+
+def sharedTranspositionTable():
+    return transpositionTable
+
+'''
+Use the opening book file at path, None turns the book off
+'''
+def setOpeningBook(path):
+    global openingBook
+    if openingBook is not None:
+        openingBook.close()
+    openingBook = None if path is None else OpeningBook(path)
 
 def findRandomMove(validMoves):
     return validMoves[random.randint(0, len(validMoves)-1)]
@@ -23,54 +69,422 @@ def greedyMove(gs, validMoves):
         elif gs.staleMate:
             score = staleMate
         else:
-            score = turn * scoreValue(gs.board)
+            score = turn * gs.material
         if score > maxScore:
             maxScore = score
             bestMove = playerMove
         gs.undoMove()
     return bestMove
 
-def scoreValue(board):
+def scoreValue(squares):
     score = 0
-    for row in board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScores[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScores[square[1]]
+    for square in squares:
+        score += codeScores[square]
 
     return score
 
 def findBestMoveAlphaBetaPruning(gs, validMoves):
-    global nextMove
-    nextMove = None
-    random.shuffle(validMoves)      #To get first move variation
-    findMoveAlphaBetaPruning(gs, validMoves, DEPTH, -checkMate, checkMate, 1 if gs.whiteToMove else -1)
-    #print(nextMove)
-    return nextMove
+    return search(gs, maxDepth=DEPTH, validMoves=validMoves, randomize=True).bestMove     #Randomized to get first move variation
 
-def findMoveAlphaBetaPruning(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
+'''
+Iterative deepening search.
+Searches one ply deeper at a time until maxDepth or until timeLimitMs passes, and returns the SearchResult of the
+deepest finished iteration. The first iteration is always finished, so a best move is ready whenever there is one.
+A move of the opening book is returned at once with depth 0, unless useBook is False.
+Other options are passed on to Searcher
+'''
+def search(gs, timeLimitMs=None, maxDepth=MAX_DEPTH, validMoves=None, useBook=True, **options):
+    result = bookMove(gs, validMoves) if useBook else None
+    if result is not None:
+        return result
+    return Searcher(gs, timeLimitMs, maxDepth, **options).search(validMoves)
 
-    if depth == 0:      #Return value when at the bottom of the depth
-        return turnMultiplier * scoreBoard(gs)
+'''
+SearchResult of depth 0 holding a move of the opening book, or None when there is no book or no book move
+'''
+def bookMove(gs, validMoves=None):
+    if openingBook is None:
+        return None
+    startTime = time.perf_counter()
+    move = openingBook.pickMove(gs, validMoves)
+    if move is None:
+        return None
+    return SearchResult(move, 0, 0, [move], 0, (time.perf_counter() - startTime) * 1000)
 
-    maxScore = -checkMate
-    for move in validMoves:
-        gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -findMoveAlphaBetaPruning(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:  # To get the move at the very last evaluation
-                nextMove = move
-        gs.undoMove()       #Move is made for calculation, so undo is needed
-        if maxScore > alpha:
-            alpha = maxScore
-        if alpha >= beta:
-            break
-    return maxScore
 
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult():
+    __slots__ = ('bestMove', 'score', 'depth', 'pv', 'nodes', 'timeMs', 'stats')
+
+    def __init__(self, bestMove, score, depth, pv, nodes, timeMs, stats=None):
+        self.bestMove = bestMove
+        self.score = score      #From the point of view of the player to move
+        self.depth = depth
+        self.pv = pv        #Principal variation, expected moves starting with bestMove
+        self.nodes = nodes
+        self.timeMs = timeMs
+        self.stats = stats      #SearchStats of the whole search
+
+    def nodesPerSecond(self):
+        return int(self.nodes * 1000 / self.timeMs) if self.timeMs > 0 else 0
+
+
+'''
+Alpha-beta search of one position.
+randomize shuffles the root moves, so equally scored moves vary from game to game.
+orderer can replace the default MoveOrderer by any object with orderMoves and recordCutoff methods.
+quiescenceNodeLimit caps the capture search at the leaves, 0 turns it off.
+nodeLimit stops the search after about that many nodes.
+infoCallback is called with the SearchResult of every finished iteration.
+leafScorer(gs, moves) returns the static scores, from the point of view of white, of the positions after all the moves at once.
+When given, the last ply is scored with it and the capture search stands pat on those scores, e.g. BatchEvaluation.scoreChildren.
+profiler is 'cprofile' or 'sample' to profile the search, the busiest functions end up in stats.profile.
+pvs searches every move after the first with a zero window and searches it again in full only when it beats alpha.
+nullMove lets the player to move pass at a node with a static score above beta: if a shallower search after the pass still
+fails high, the node is cut off. It is left out in check and when the player has nothing but pawns besides the king.
+lateMoveReductions searches quiet moves late in the move order one ply shallower, and again at full depth when they beat alpha.
+transpositionTable replaces the shared table of the module, e.g. to keep the searches of two engine settings apart.
+Counts and times of the search are kept in stats, a SearchStats.
+stop() may be called from another thread, the search then returns as soon as the first iteration is done
+'''
+class Searcher():
+
+    def __init__(self, gs, timeLimitMs=None, maxDepth=MAX_DEPTH, randomize=False, orderer=None, quiescenceNodeLimit=QUIESCENCE_NODE_LIMIT,
+                 nodeLimit=None, infoCallback=None, leafScorer=None, profiler=None, pvs=True, nullMove=True, lateMoveReductions=True,
+                 transpositionTable=None):
+        self.gs = gs
+        self.maxDepth = max(1, maxDepth)    #At least one iteration, so there is always a move to return
+        self.timeLimitMs = timeLimitMs
+        self.nodeLimit = nodeLimit
+        self.infoCallback = infoCallback
+        self.leafScorer = leafScorer
+        self.stopped = False
+        self.randomize = randomize
+        self.pvs = pvs
+        self.nullMove = nullMove
+        self.lateMoveReductions = lateMoveReductions
+        self.transpositionTable = sharedTranspositionTable() if transpositionTable is None else transpositionTable
+        self.orderer = MoveOrderer(pieceScores, ShogiEngine.pieceLetters) if orderer is None else orderer
+        self.quiescenceNodeLimit = quiescenceNodeLimit
+        self.quiescenceNodes = 0
+        self.deadline = None
+        self.nodes = 0
+        self.nextTimeCheck = NODES_PER_TIME_CHECK
+        self.rootDepth = 0
+        self.pvTable = []       #Best line found below every ply of the current iteration
+        self.stats = SearchStats()
+        self.profiler = None if profiler is None else makeProfiler(profiler)
+
+    def search(self, validMoves=None):
+        if self.profiler is None:
+            return self.iterativeDeepening(validMoves)
+        self.profiler.start()
+        try:
+            return self.iterativeDeepening(validMoves)
+        finally:
+            self.profiler.stop()
+            self.stats.profile = self.profiler.lines()
+
+    def iterativeDeepening(self, validMoves):
+        gs = self.gs
+        stats = self.stats
+        startTime = time.perf_counter()
+        if self.timeLimitMs is not None:
+            self.deadline = startTime + self.timeLimitMs / 1000
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            return SearchResult(None, -checkMate if gs.checkMate else staleMate, 0, [], 0, 0, stats)
+
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        rootPly = len(gs.moveLog)
+        rootMoves = list(validMoves)
+        if self.randomize:
+            random.shuffle(rootMoves)
+        result = None
+        for depth in range(1, self.maxDepth + 1):
+            self.rootDepth = depth
+            self.pvTable = [[] for ply in range(depth + 1)]
+            try:
+                score = self.findMoveAlphaBetaPruning(rootMoves, depth, -checkMate, checkMate, turnMultiplier, 0)
+            except SearchTimeout:
+                while len(gs.moveLog) > rootPly:    #Take back the moves of the unfinished iteration
+                    gs.undoMove()
+                break
+            pv = self.completePv(self.pvTable[0], depth)
+            timeMs = (time.perf_counter() - startTime) * 1000
+            result = SearchResult(pv[0], score, depth, pv, self.nodes, timeMs, stats)
+            stats.iterations.append((depth, score, self.nodes, timeMs))
+            if self.infoCallback is not None:
+                self.infoCallback(result)
+            if abs(score) >= checkMate or self.limitReached():
+                break
+        result.nodes = self.nodes       #Include the nodes and time of an unfinished last iteration
+        result.timeMs = (time.perf_counter() - startTime) * 1000
+        stats.totalTime = result.timeMs / 1000
+        return result
+
+    '''
+    Valid moves of the position, timed for the stats
+    '''
+    def generateMoves(self):
+        startTime = time.perf_counter()
+        moves = self.gs.getValidMoves()
+        self.stats.moveGenTime += time.perf_counter() - startTime
+        return moves
+
+    '''
+    The line is cut short below nodes answered by the transposition table, so it is continued with the stored best moves
+    '''
+    def completePv(self, pv, depth):
+        gs = self.gs
+        pv = list(pv)
+        for move in pv:
+            gs.makeMove(move)
+        while len(pv) < depth:
+            entry = self.transpositionTable.probe(gs.zobristKey)
+            if entry is None or entry[4] is None:
+                break
+            move = next((move for move in gs.getValidMoves() if move.moveId == entry[4]), None)
+            if move is None:
+                break
+            pv.append(move)
+            gs.makeMove(move)
+        for move in pv:
+            gs.undoMove()
+        return pv
+
+    def stop(self):
+        self.stopped = True
+
+    def timeUp(self):
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def limitReached(self):
+        return self.stopped or self.timeUp() or (self.nodeLimit is not None and self.nodes >= self.nodeLimit)
+
+    '''
+    Abandon the iteration once the deadline, the node limit or a stop has come, the first iteration always finishes
+    '''
+    def checkTime(self):
+        self.nextTimeCheck = self.nodes + NODES_PER_TIME_CHECK
+        if self.rootDepth > 1 and self.limitReached():
+            raise SearchTimeout()
+
+    def findMoveAlphaBetaPruning(self, validMoves, depth, alpha, beta, turnMultiplier, ply):
+        gs = self.gs
+        stats = self.stats
+        self.nodes += 1
+        stats.nodesByPly[ply] += 1
+        if self.nodes >= self.nextTimeCheck:
+            self.checkTime()
+
+        if depth == 0:      #Return value when at the bottom of the depth, once the captures have settled
+            return self.quiescence(validMoves, alpha, beta, turnMultiplier, ply)
+        if depth == 1 and self.leafScorer is not None:
+            return self.scoreLeaves(validMoves, alpha, beta, turnMultiplier, ply)
+
+        alphaOrig = alpha
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        stats.ttProbes += 1
+        if entry is not None:
+            stats.ttHits += 1
+        if entry is not None and entry[1] >= depth and ply != 0:     #Root still has to search to pick its move
+            if entry[3] == EXACT:
+                stats.ttCutoffs += 1
+                return entry[2]
+            elif entry[3] == LOWER_BOUND:
+                alpha = max(alpha, entry[2])
+            else:
+                beta = min(beta, entry[2])
+            if alpha >= beta:
+                stats.ttCutoffs += 1
+                return entry[2]
+
+        inCheck = (self.nullMove or self.lateMoveReductions) and depth >= min(NULL_MOVE_MIN_DEPTH, LMR_MIN_DEPTH) and gs.inCheck()
+        #Null move: if passing still fails high, a real move surely would
+        if (self.nullMove and ply != 0 and depth >= NULL_MOVE_MIN_DEPTH and validMoves and not inCheck and beta < checkMate
+                and gs.moveLog[-1].start != ShogiEngine.NULL and turnMultiplier * gs.material >= beta and hasPiecesBesidesPawns(gs)):
+            gs.makeNullMove()
+            stats.nullMoves += 1
+            nextMoves = self.generateMoves()
+            score = -self.findMoveAlphaBetaPruning(nextMoves, max(depth - 1 - NULL_MOVE_REDUCTION, 0), -beta, -beta + SCOUT_WINDOW,
+                                                   -turnMultiplier, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                stats.nullMoveCutoffs += 1
+                return beta     #Not a mate score, the line had an illegal pass in it
+
+        validMoves = self.orderer.orderMoves(validMoves, ply, entry[4] if entry is not None else None)     #Stored best move first
+
+        maxScore = -checkMate
+        bestMove = None
+        for moveNumber, move in enumerate(validMoves):
+            gs.makeMove(move)
+            self.pvTable[ply + 1] = []
+            if gs.keyCounts[gs.zobristKey] > 1:     #Repeated position, scored by the repetition rules without searching it again
+                self.nodes += 1
+                stats.nodesByPly[ply + 1] += 1
+                stats.repetitions += 1
+                score = -repetitionScore(gs)
+            else:
+                nextMoves = self.generateMoves()
+                reduction = 0
+                if (self.lateMoveReductions and moveNumber >= LMR_FULL_MOVES and depth >= LMR_MIN_DEPTH and not inCheck
+                        and move.pieceCapturedCode == ShogiEngine.EMPTY and not move.promotedCode and not gs.inCheck()):
+                    reduction = LMR_REDUCTION
+                if moveNumber == 0 or not (self.pvs or reduction):
+                    score = -self.findMoveAlphaBetaPruning(nextMoves, depth-1, -beta, -alpha, -turnMultiplier, ply + 1)
+                else:
+                    #Later moves are expected to fail low, which a zero window or a reduced search shows for less.
+                    #One that beats alpha after all is searched again at full depth with the full window
+                    scoutBeta = alpha + SCOUT_WINDOW if self.pvs else beta
+                    if reduction:
+                        stats.reductions += 1
+                    score = -self.findMoveAlphaBetaPruning(nextMoves, depth-1-reduction, -scoutBeta, -alpha, -turnMultiplier, ply + 1)
+                    if score > alpha and (reduction or (score < beta and scoutBeta < beta)):
+                        stats.reSearches += 1
+                        self.pvTable[ply + 1] = []
+                        score = -self.findMoveAlphaBetaPruning(nextMoves, depth-1, -beta, -alpha, -turnMultiplier, ply + 1)
+            gs.undoMove()       #Move is made for calculation, so undo is needed
+            if score > maxScore or bestMove is None:
+                maxScore = score
+                bestMove = move
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                self.orderer.recordCutoff(move, depth, ply)
+                stats.betaCutoffs += 1
+                if moveNumber == 0:
+                    stats.firstMoveCutoffs += 1
+                break
+
+        if maxScore <= alphaOrig:
+            bound = UPPER_BOUND
+        elif maxScore >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.transpositionTable.store(gs.zobristKey, depth, maxScore, bound, bestMove.moveId if bestMove is not None else None)
+        return maxScore
+
+    '''
+    Best child of a node one ply above the leaves, with the children scored together by leafScorer and tried best first
+    with the alpha-beta cutoff. Every child goes on to the capture search, which stands pat on the batch score: the search counts
+    material only, so the piece-square part of the batch score is added to what it finds
+    '''
+    def scoreLeaves(self, validMoves, alpha, beta, turnMultiplier, ply):
+        gs = self.gs
+        stats = self.stats
+        startTime = time.perf_counter()
+        scores = self.leafScorer(gs, validMoves)
+        stats.evalTime += time.perf_counter() - startTime
+        stats.leafEvaluationsByPly[ply + 1] += len(validMoves)
+        order = sorted(range(len(validMoves)), key=lambda i: turnMultiplier * scores[i], reverse=True)
+        maxScore = -checkMate
+        bestMove = None
+        for moveNumber, i in enumerate(order):
+            move = validMoves[i]
+            score = turnMultiplier * float(scores[i])
+            self.nodes += 1
+            stats.nodesByPly[ply + 1] += 1
+            if self.nodes >= self.nextTimeCheck:
+                self.checkTime()
+            gs.makeMove(move)
+            if gs.keyCounts[gs.zobristKey] > 1:
+                stats.repetitions += 1
+                score = -repetitionScore(gs)
+            else:
+                nextMoves = self.generateMoves()
+                if gs.checkMate or gs.staleMate:
+                    score = turnMultiplier * scoreBoard(gs)
+                else:
+                    offset = score - turnMultiplier * gs.material
+                    captureScore = -self.quiescence(nextMoves, offset - beta, offset - alpha, -turnMultiplier, ply + 1)
+                    score = captureScore if abs(captureScore) >= checkMate else captureScore + offset
+            gs.undoMove()
+            if score > maxScore or bestMove is None:
+                maxScore = score
+                bestMove = move
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                self.orderer.recordCutoff(move, 1, ply)
+                stats.betaCutoffs += 1
+                if moveNumber == 0:
+                    stats.firstMoveCutoffs += 1
+                break
+        if bestMove is not None:
+            self.pvTable[ply] = [bestMove]
+        return maxScore
+
+    '''
+    Capture only search, so a leaf in the middle of an exchange is not scored before the recapture.
+    The player to move may stand pat on the static score instead of capturing
+    '''
+    def quiescence(self, validMoves, alpha, beta, turnMultiplier, ply):
+        gs = self.gs
+        stats = self.stats
+        startTime = time.perf_counter()
+        standPat = turnMultiplier * scoreBoard(gs)
+        stats.evalTime += time.perf_counter() - startTime
+        stats.leafEvaluationsByPly[ply] += 1
+        if gs.checkMate or gs.staleMate or self.quiescenceNodes >= self.quiescenceNodeLimit:
+            return standPat
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+
+        captures = [move for move in validMoves if move.pieceCapturedCode != ShogiEngine.EMPTY]
+        maxScore = standPat
+        for move in self.orderer.orderMoves(captures, ply):
+            #Delta pruning: skip captures that can not raise the score to alpha even with a promotion on top
+            if standPat + captureGains[move.pieceCapturedCode] + DELTA_MARGIN + (PROMOTION_GAIN if move.promotedCode else 0) <= alpha:
+                continue
+            self.nodes += 1
+            self.quiescenceNodes += 1
+            stats.nodesByPly[ply + 1] += 1
+            stats.quiescenceNodes += 1
+            if self.nodes >= self.nextTimeCheck:
+                self.checkTime()
+            gs.makeMove(move)
+            nextMoves = self.generateMoves()
+            score = -self.quiescence(nextMoves, -beta, -alpha, -turnMultiplier, ply + 1)
+            gs.undoMove()
+            if score > maxScore:
+                maxScore = score
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                break
+        return maxScore
+
+
+'''
+Score of a repeated position for the player to move: a draw, or a win or a loss when the repetition came from perpetual check
+'''
+def repetitionScore(gs):
+    state = gs.repetition()
+    if state == ShogiEngine.PERPETUAL_CHECK_WIN:
+        return perpetualCheck
+    if state == ShogiEngine.PERPETUAL_CHECK_LOSS:
+        return -perpetualCheck
+    return sennichite
+
+'''
+If the player to move has a piece besides the king and pawns, on the board or in hand.
+With nothing else to move passing may really be best, so a pass proves nothing
+'''
+def hasPiecesBesidesPawns(gs):
+    if any(gs.hands[gs.whiteToMove][ShogiEngine.PAWN + 1:]):
+        return True
+    sign = 1 if gs.whiteToMove else -1
+    return any(ShogiEngine.PAWN < piece * sign != ShogiEngine.KING for piece in gs.squares)
 
 def scoreBoard(gs):
     if gs.checkMate:
@@ -81,13 +495,6 @@ def scoreBoard(gs):
     elif gs.staleMate:
         return staleMate
 
-    score = 0
-    for row in gs.board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScores[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScores[square[1]]
-    return score
+    return gs.material
 
 
@@ -0,0 +1,84 @@
+'''
+Searches run on a worker thread, so a GUI keeps drawing and handling events while the engine thinks.
+A search works on its own copy of the game, the caller's GameState can be drawn and changed meanwhile:
+handle = SearchHandle(gs, maxDepth=2)
+... every frame: handle.progress() for the best line so far, handle.isDone() and then handle.result
+The search shares the GIL with the caller, which gets its turn at least every sys.getswitchinterval() seconds
+'''
+import threading
+import AIMoveFinder
+
+
+class SearchHandle():
+
+    '''
+    Starts searching at once. Options are those of AIMoveFinder.search, the opening book is tried first
+    '''
+    def __init__(self, gs, useBook=True, **options):
+        self.gs = gs.copy()
+        self.positionKey = self.gs.zobristKey
+        self.useBook = useBook
+        self.searcher = AIMoveFinder.Searcher(self.gs, infoCallback=self.iterationDone, **options)
+        self.best = None        #SearchResult of the deepest finished iteration
+        self.result = None      #Final SearchResult, set when the search ends
+        self.cancelled = False
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            result = AIMoveFinder.bookMove(self.gs) if self.useBook else None
+            self.result = self.searcher.search() if result is None else result
+        finally:
+            self.finished.set()
+
+    def iterationDone(self, result):
+        self.best = result
+
+    def isDone(self):
+        return self.finished.is_set()
+
+    '''
+    Wait for the search to end, or at most timeout seconds. Returns the result or None
+    '''
+    def wait(self, timeout=None):
+        self.finished.wait(timeout)
+        return self.result
+
+    '''
+    Stop the search without waiting for it, the worker ends as soon as the iteration it is in is done or given up
+    '''
+    def cancel(self):
+        self.cancelled = True
+        self.searcher.stop()
+
+    '''
+    (depth, best line, score, nodes) of the search so far, the line is empty until the first iteration is done
+    '''
+    def progress(self):
+        best = self.best if self.result is None else self.result
+        if best is None:
+            return 0, [], 0, self.searcher.nodes
+        return best.depth, best.pv, best.score, self.searcher.nodes
+
+    '''
+    If the search is of the same position as gs
+    '''
+    def matches(self, gs):
+        return gs.zobristKey == self.positionKey and gs.whiteToMove == self.gs.whiteToMove
+
+
+'''
+Search of the reply to move, started while the opponent is still thinking about their move.
+When they play it, the search goes on as the real one and has a head start. Returns None if move is not valid
+'''
+def ponder(gs, move, **options):
+    copy = gs.copy()
+    move = next((valid for valid in copy.getValidMoves() if valid.moveId == move.moveId), None)
+    if move is None:
+        return None
+    copy.makeMove(move)
+    if not copy.getValidMoves():    #The expected move ends the game, nothing to reply
+        return None
+    return SearchHandle(copy, **options)
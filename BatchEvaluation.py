@@ -0,0 +1,97 @@
+'''
+Batch evaluation of many positions at once with NumPy, for labelling positions offline and for scoring all children of a
+search node in one call. Needs numpy, which the rest of the engine does not.
+
+A batch of K positions is a (K, 9, 9) int8 array of piece codes, the layout of GameState.squares.
+Scores are material plus piece-square terms in pawns, from the point of view of white like GameState.material.
+Pieces in hand are worth their material, a batch of boards leaves them out and evaluateStates adds them
+'''
+import numpy as np
+import ShogiEngine
+
+'''
+Piece-square bonus of white pieces in pawns: ADVANCEMENT per row a piece has moved up the board from its own back rank
+and CENTRE for standing on the middle file, shrinking towards the edges. Black pieces use the same bonus mirrored
+'''
+ADVANCEMENT = {ShogiEngine.PAWN: 0.05, ShogiEngine.SILVER: 0.04, ShogiEngine.KNIGHT: 0.03, ShogiEngine.LANCE: 0.01}
+CENTRE = {ShogiEngine.SILVER: 0.1, ShogiEngine.GOLD: 0.05, ShogiEngine.BISHOP: 0.1, ShogiEngine.PROM_BISHOP: 0.2, ShogiEngine.PROM_ROOK: 0.2}
+KING_SHELTER = 0.2  #White king in one of its two back rows, where the golds and silvers can cover it
+HAND = 81   #Column of the piece-square table holding the score of a piece in hand, where drops start from
+
+def buildPieceSquareTable():
+    table = np.zeros((len(ShogiEngine.pieceNames), HAND + 1), dtype=np.float32)
+    rows, cols = np.divmod(np.arange(81), 9)
+    for piece in range(ShogiEngine.PAWN, len(ShogiEngine.pieceLetters)):
+        bonus = (8 - rows) * ADVANCEMENT.get(piece, 0.0) + (4 - np.abs(cols - 4)) / 4 * CENTRE.get(piece, 0.0)
+        if piece == ShogiEngine.KING:
+            bonus = bonus + (rows >= 7) * KING_SHELTER
+        white = ShogiEngine.codeScores[piece] + bonus
+        table[piece, :HAND] = white
+        table[-piece, :HAND] = -white[::-1]     #Square 80 - sq is the same square seen from black
+        table[piece, HAND] = ShogiEngine.codeScores[piece]
+        table[-piece, HAND] = -ShogiEngine.codeScores[piece]
+    return table
+
+pieceSquareTable = buildPieceSquareTable()     #Indexed by piece code like pieceNames, then by square or HAND
+squareIndex = np.arange(81)
+
+'''
+Score the capturer gains in hand, indexed by the code of the captured piece
+'''
+def buildCaptureHandScores():
+    scores = np.zeros(len(ShogiEngine.pieceNames), dtype=np.float32)
+    for piece in range(ShogiEngine.PAWN, len(ShogiEngine.pieceLetters)):
+        scores[piece] = -ShogiEngine.codeScores[ShogiEngine.handTypes[piece]]
+        scores[-piece] = ShogiEngine.codeScores[ShogiEngine.handTypes[piece]]
+    return scores
+
+captureHandScores = buildCaptureHandScores()
+
+
+'''
+(K, 9, 9) int8 array of the boards of the given game states
+'''
+def encodePositions(states):
+    return np.array([gs.squares for gs in states], dtype=np.int8).reshape(-1, 9, 9)
+
+'''
+Game state of one (9, 9) board of a batch
+'''
+def decodePosition(board, whiteToMove=True):
+    gs = ShogiEngine.GameState.__new__(ShogiEngine.GameState)
+    gs.setup([int(piece) for piece in board.reshape(81)], whiteToMove)
+    return gs
+
+'''
+Scores of a (K, 9, 9) batch of boards, a float32 array of length K
+'''
+def evaluateBatch(boards):
+    codes = boards.reshape(-1, 81).astype(np.intp)
+    return pieceSquareTable[codes, squareIndex].sum(axis=1)
+
+'''
+Material of the pieces in hand of every state, a float32 array
+'''
+def handScores(states):
+    return np.array([sum(ShogiEngine.codeScores[piece] * (gs.hands[1][piece] - gs.hands[0][piece]) for piece in ShogiEngine.handPieces)
+                     for gs in states], dtype=np.float32)
+
+def evaluateStates(states):
+    return evaluateBatch(encodePositions(states)) + handScores(states)
+
+'''
+Static scores of the positions after each of the moves, all computed from the parent by the squares the moves change.
+A drop starts from the HAND column and a capture adds the captured piece to the hand of the mover.
+Mates are not detected, the caller has to look at the positions for that
+'''
+def scoreChildren(gs, moves):
+    if not moves:
+        return np.zeros(0, dtype=np.float32)
+    parent = evaluateStates([gs])[0]
+    starts = np.fromiter((min(move.start, HAND) for move in moves), dtype=np.intp, count=len(moves))
+    ends = np.fromiter((move.end for move in moves), dtype=np.intp, count=len(moves))
+    moved = np.fromiter((move.pieceMovedCode for move in moves), dtype=np.intp, count=len(moves))
+    captured = np.fromiter((move.pieceCapturedCode for move in moves), dtype=np.intp, count=len(moves))
+    arrived = np.fromiter((move.promotedCode or move.pieceMovedCode for move in moves), dtype=np.intp, count=len(moves))
+    table = pieceSquareTable
+    return parent - table[moved, starts] - table[captured, ends] + table[arrived, ends] + captureHandScores[captured]
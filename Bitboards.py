@@ -0,0 +1,472 @@
+'''
+Bitboard backend: the position as 81 bit Python ints, one per piece code and one per player, bit r*9 + c for square (r, c).
+An alternative to GameState for bulk move generation and attack queries, with the same interface as far as
+move generation, making and undoing moves go:
+gs = BitboardState.fromGameState(ShogiEngine.GameState())
+Step attacks are table lookups or shifts of whole bitboards, slider attacks are found from the first blocker on a ray
+'''
+import ShogiEngine
+from ShogiEngine import (EMPTY, PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING, PROM_BISHOP, PROM_ROOK,
+                         PROM_PAWN, PROM_LANCE, PROM_KNIGHT, PROM_SILVER, DROP, NULL, Move)
+
+FULL = (1 << 81) - 1
+FILE_0 = sum(1 << (r*9) for r in range(9))      #Column 0, the squares a shift to the left wraps onto
+FILE_8 = FILE_0 << 8
+GOLD_MOVERS = (GOLD, PROM_PAWN, PROM_LANCE, PROM_KNIGHT, PROM_SILVER)
+
+def bitCount(bb):
+    return bin(bb).count('1')
+
+'''
+Squares of a bitboard in increasing order
+'''
+def bitSquares(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+'''
+Whole bitboard moved dr rows and dc columns, squares falling off the board are dropped
+'''
+def shiftBoard(bb, dr, dc):
+    if dc > 0:
+        bb &= ~(FILE_8 if dc == 1 else FILE_8 | FILE_8 >> 1)
+    elif dc < 0:
+        bb &= ~(FILE_0 if dc == -1 else FILE_0 | FILE_0 << 1)
+    delta = dr*9 + dc
+    return (bb << delta) & FULL if delta > 0 else bb >> -delta
+
+'''
+rayMasks[direction][square] holds the squares beyond the square in that direction up to the edge.
+Directions are the king offsets, the ones pointing to higher square numbers are looked up from the low end
+'''
+directions = ShogiEngine.kingMoves
+directionIndex = {d: i for i, d in enumerate(directions)}
+positiveDirection = [dr*9 + dc > 0 for dr, dc in directions]
+rayMasks = [[sum(1 << sq for sq in ShogiEngine.raySquares(s // 9, s % 9, dr, dc, True)) for s in range(81)] for dr, dc in directions]
+
+'''
+stepMasks[color][piece][square] holds the squares a piece steps to, color 0 for black and 1 for white
+'''
+def buildStepMasks(color):
+    masks = [[0] * 81 for piece in range(len(ShogiEngine.pieceLetters))]
+    for piece, offsets in ShogiEngine.stepOffsets.items():
+        for sq in range(81):
+            masks[piece][sq] = sum(1 << end for dr, dc in offsets[color] for end in ShogiEngine.raySquares(sq // 9, sq % 9, dr, dc, False))
+    return masks
+
+stepMasks = (buildStepMasks(0), buildStepMasks(1))
+slideDirectionIndexes = tuple({piece: tuple(directionIndex[d] for d in dirs[color]) for piece, dirs in ShogiEngine.slideDirections.items()}
+                              for color in (0, 1))
+kingMasks = stepMasks[1][KING]
+orthogonalIndexes = tuple(directionIndex[d] for d in ShogiEngine.orthogonals)
+diagonalIndexes = tuple(directionIndex[d] for d in ShogiEngine.diagonals)
+#Sliding pieces of each player that attack a square from the given direction, like ShogiEngine.slideAttacks
+sliderSets = tuple([dict(((dr, dc), sliders) for dr, dc, sliders in ShogiEngine.slideAttacks[color]).get(d, frozenset()) for d in directions]
+                   for color in (0, 1))
+
+'''
+dropMasks[color][piece] holds the squares of ShogiEngine.dropRanges and pawnFileMasks[files] every square of the columns
+set in a pawn file mask of GameState.pawnFiles
+'''
+dropMasks = tuple({piece: sum(1 << sq for sq in range(first, last)) for piece, (first, last) in ranges.items()}
+                  for ranges in ShogiEngine.dropRanges)
+pawnFileMasks = [sum(FILE_0 << c for c in range(9) if files >> c & 1) for files in range(512)]
+
+
+def slideAttack(sq, direction, occupied):
+    ray = rayMasks[direction][sq]
+    blockers = ray & occupied
+    if blockers:
+        if positiveDirection[direction]:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= rayMasks[direction][blocker]     #Squares behind the first blocker are cut off
+    return ray
+
+
+class BitboardState():
+    __slots__ = ('squares', 'pieces', 'colors', 'whiteToMove', 'moveLog', 'whiteKingLocation', 'blackKingLocation',
+                 'checkMate', 'staleMate', 'zobristKey', 'material', 'hands', 'pawnFiles', 'keyHistory', 'keyCounts')
+
+    '''
+    Position from a flat board of 81 piece codes and the hands like GameState.hands, both are copied
+    '''
+    def __init__(self, squares, whiteToMove=True, hands=None):
+        self.squares = list(squares)
+        self.pieces = [0] * len(ShogiEngine.pieceNames)     #Bitboard of every piece code, indexed like pieceNames
+        self.colors = [0, 0]        #Black and white occupancy
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                self.pieces[piece] |= 1 << sq
+                self.colors[piece > 0] |= 1 << sq
+        self.whiteToMove = whiteToMove
+        self.moveLog = []
+        self.whiteKingLocation = divmod(self.squares.index(KING), 9)
+        self.blackKingLocation = divmod(self.squares.index(-KING), 9)
+        self.hands = [[0] * KING, [0] * KING] if hands is None else [list(hand) for hand in hands]
+        self.pawnFiles = [0, 0]
+        for sq in bitSquares(self.pieces[PAWN] | self.pieces[-PAWN]):
+            self.pawnFiles[self.squares[sq] > 0] |= ShogiEngine.fileBits[sq]
+        self.checkMate = False
+        self.staleMate = False
+        self.zobristKey = ShogiEngine.GameState.computeZobristKey(self)
+        self.material = ShogiEngine.GameState.computeMaterial(self)
+        self.keyHistory = [self.zobristKey]
+        self.keyCounts = {self.zobristKey: 1}
+
+    @classmethod
+    def fromGameState(cls, gs):
+        return cls(gs.squares, gs.whiteToMove, gs.hands)
+
+    @property
+    def board(self):
+        return ShogiEngine.GameState.board.fget(self)
+
+    def makeMove(self, move):
+        squares = self.squares
+        pieces = self.pieces
+        start = move.start
+        end = move.end
+        moved = move.pieceMovedCode
+        zobristHands = ShogiEngine.zobristHands
+        if start >= DROP:
+            piece = start - DROP
+            color = moved > 0
+            hand = self.hands[color]
+            count = hand[piece]
+            hand[piece] = count - 1
+            endBit = 1 << end
+            pieces[moved] |= endBit
+            self.colors[color] |= endBit
+            squares[end] = moved
+            if piece == PAWN:
+                self.pawnFiles[color] |= ShogiEngine.fileBits[end]
+            self.moveLog.append(move)
+            self.whiteToMove = not self.whiteToMove
+            self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count - 1] \
+                               ^ ShogiEngine.zobristPieces[moved][end] ^ ShogiEngine.zobristBlackToMove
+            ShogiEngine.GameState.recordPosition(self)
+            return
+        captured = move.pieceCapturedCode
+        arrived = move.promotedCode or moved
+        startBit = 1 << start
+        endBit = 1 << end
+        pieces[moved] ^= startBit
+        pieces[arrived] |= endBit
+        self.colors[moved > 0] ^= startBit | endBit
+        if captured:
+            pieces[captured] ^= endBit
+            self.colors[captured > 0] ^= endBit
+        squares[start] = EMPTY
+        squares[end] = arrived
+        self.moveLog.append(move)
+        self.whiteToMove = not self.whiteToMove
+        if moved == KING:
+            self.whiteKingLocation = divmod(end, 9)
+        elif moved == -KING:
+            self.blackKingLocation = divmod(end, 9)
+        zobristPieces = ShogiEngine.zobristPieces
+        self.zobristKey ^= zobristPieces[moved][start] ^ zobristPieces[captured][end] ^ zobristPieces[arrived][end] ^ ShogiEngine.zobristBlackToMove
+        codeScores = ShogiEngine.codeScores
+        self.material += codeScores[arrived] - codeScores[moved] - codeScores[captured]
+        if move.promotedCode and (moved == PAWN or moved == -PAWN):
+            self.pawnFiles[moved > 0] &= ~ShogiEngine.fileBits[start]
+        if captured:
+            color = moved > 0
+            piece = ShogiEngine.handTypes[captured]
+            hand = self.hands[color]
+            count = hand[piece]
+            hand[piece] = count + 1
+            self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count + 1]
+            self.material += codeScores[piece] if color else -codeScores[piece]
+            if captured == PAWN or captured == -PAWN:
+                self.pawnFiles[not color] &= ~ShogiEngine.fileBits[end]
+        ShogiEngine.GameState.recordPosition(self)
+
+    '''
+    Pass the turn like GameState.makeNullMove
+    '''
+    def makeNullMove(self):
+        self.moveLog.append(ShogiEngine.NullMove(self.keyCounts))
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= ShogiEngine.zobristBlackToMove
+        self.keyCounts = {}
+        ShogiEngine.GameState.recordPosition(self)
+
+    def undoMove(self):
+        if len(self.moveLog) != 0:
+            ShogiEngine.GameState.forgetPosition(self)
+            move = self.moveLog.pop()
+            squares = self.squares
+            pieces = self.pieces
+            start = move.start
+            end = move.end
+            moved = move.pieceMovedCode
+            zobristHands = ShogiEngine.zobristHands
+            if start == NULL:
+                self.whiteToMove = not self.whiteToMove
+                self.zobristKey ^= ShogiEngine.zobristBlackToMove
+                self.keyCounts = move.keyCounts
+                self.checkMate = False
+                self.staleMate = False
+                return
+            if start >= DROP:
+                piece = start - DROP
+                color = moved > 0
+                hand = self.hands[color]
+                count = hand[piece]
+                hand[piece] = count + 1
+                endBit = 1 << end
+                pieces[moved] ^= endBit
+                self.colors[color] ^= endBit
+                squares[end] = EMPTY
+                if piece == PAWN:
+                    self.pawnFiles[color] &= ~ShogiEngine.fileBits[end]
+                self.whiteToMove = not self.whiteToMove
+                self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count + 1] \
+                                   ^ ShogiEngine.zobristPieces[moved][end] ^ ShogiEngine.zobristBlackToMove
+                self.checkMate = False
+                self.staleMate = False
+                return
+            captured = move.pieceCapturedCode
+            arrived = squares[end]
+            startBit = 1 << start
+            endBit = 1 << end
+            pieces[arrived] ^= endBit
+            pieces[moved] |= startBit
+            self.colors[moved > 0] ^= startBit | endBit
+            if captured:
+                pieces[captured] |= endBit
+                self.colors[captured > 0] |= endBit
+            squares[start] = moved
+            squares[end] = captured
+            self.whiteToMove = not self.whiteToMove
+            if moved == KING:
+                self.whiteKingLocation = divmod(start, 9)
+            elif moved == -KING:
+                self.blackKingLocation = divmod(start, 9)
+            zobristPieces = ShogiEngine.zobristPieces
+            self.zobristKey ^= zobristPieces[moved][start] ^ zobristPieces[captured][end] ^ zobristPieces[arrived][end] ^ ShogiEngine.zobristBlackToMove
+            codeScores = ShogiEngine.codeScores
+            self.material -= codeScores[arrived] - codeScores[moved] - codeScores[captured]
+            if move.promotedCode and (moved == PAWN or moved == -PAWN):
+                self.pawnFiles[moved > 0] |= ShogiEngine.fileBits[start]
+            if captured:
+                color = moved > 0
+                piece = ShogiEngine.handTypes[captured]
+                hand = self.hands[color]
+                count = hand[piece]
+                hand[piece] = count - 1
+                self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count - 1]
+                self.material -= codeScores[piece] if color else -codeScores[piece]
+                if captured == PAWN or captured == -PAWN:
+                    self.pawnFiles[not color] |= ShogiEngine.fileBits[end]
+        self.checkMate = False
+        self.staleMate = False
+
+    def repetitionCount(self):
+        return self.keyCounts[self.zobristKey]
+
+    def repetition(self):
+        return ShogiEngine.GameState.repetition(self)
+
+    '''
+    Squares the piece on sq attacks with the given occupancy
+    '''
+    def attacksFrom(self, piece, sq, occupied):
+        color = 1 if piece > 0 else 0
+        piece = abs(piece)
+        attacks = stepMasks[color][piece][sq]
+        for direction in slideDirectionIndexes[color].get(piece, ()):
+            attacks |= slideAttack(sq, direction, occupied)
+        return attacks
+
+    '''
+    Bitboard of the pieces of color (1 for white, -1 for black) attacking sq.
+    Every piece moves the same to the left and right, so a piece attacks sq exactly when the same piece of the other
+    player standing on sq would attack it
+    '''
+    def attackersTo(self, sq, color, occupied=None):
+        pieces = self.pieces
+        if occupied is None:
+            occupied = self.colors[0] | self.colors[1]
+        reverse = stepMasks[0 if color > 0 else 1]
+        attackers = reverse[PAWN][sq] & pieces[PAWN * color]
+        attackers |= reverse[KNIGHT][sq] & pieces[KNIGHT * color]
+        attackers |= reverse[SILVER][sq] & pieces[SILVER * color]
+        golds = 0
+        for piece in GOLD_MOVERS:
+            golds |= pieces[piece * color]
+        attackers |= reverse[GOLD][sq] & golds
+        #Adjacent squares are covered by the king and by the steps and slides of the promoted Rook and Bishop
+        attackers |= kingMasks[sq] & (pieces[KING * color] | pieces[PROM_ROOK * color] | pieces[PROM_BISHOP * color])
+        rooks = pieces[ROOK * color] | pieces[PROM_ROOK * color]
+        if rooks:
+            for direction in orthogonalIndexes:
+                attackers |= slideAttack(sq, direction, occupied) & rooks
+        bishops = pieces[BISHOP * color] | pieces[PROM_BISHOP * color]
+        if bishops:
+            for direction in diagonalIndexes:
+                attackers |= slideAttack(sq, direction, occupied) & bishops
+        lances = pieces[LANCE * color]
+        if lances:
+            attackers |= slideAttack(sq, directionIndex[(1, 0) if color > 0 else (-1, 0)], occupied) & lances
+        return attackers
+
+    def isAttacked(self, sq, color):
+        return self.attackersTo(sq, color) != 0
+
+    def squareUnderAttack(self, r, c):
+        sign = 1 if self.whiteToMove else -1
+        if self.squares[r*9 + c] * sign < 0:    #Opponent can not move onto its own piece
+            return False
+        return self.isAttacked(r*9 + c, -sign)
+
+    def inCheck(self):
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        return self.isAttacked(kingRow*9 + kingCol, -1 if self.whiteToMove else 1)
+
+    '''
+    Every square attacked by color (1 for white, -1 for black) at once, the step pieces by shifting whole bitboards
+    '''
+    def attackedSquares(self, color, occupied=None):
+        pieces = self.pieces
+        if occupied is None:
+            occupied = self.colors[0] | self.colors[1]
+        table = 1 if color > 0 else 0
+        attacked = 0
+        for piece, offsets in ShogiEngine.stepOffsets.items():
+            bb = pieces[piece * color]
+            if bb:
+                for dr, dc in offsets[table]:
+                    attacked |= shiftBoard(bb, dr, dc)
+        for piece, indexes in slideDirectionIndexes[table].items():
+            for sq in bitSquares(pieces[piece * color]):
+                for direction in indexes:
+                    attacked |= slideAttack(sq, direction, occupied)
+        return attacked
+
+    '''
+    Squares the pieces of color can move to, counted per piece
+    '''
+    def mobility(self, color):
+        squares = self.squares
+        own = self.colors[1 if color > 0 else 0]
+        occupied = self.colors[0] | self.colors[1]
+        return sum(bitCount(self.attacksFrom(squares[sq], sq, occupied) & ~own) for sq in bitSquares(own))
+
+    '''
+    Squares next to the king of color that the opponent attacks
+    '''
+    def kingDanger(self, color):
+        kingRow, kingCol = self.whiteKingLocation if color > 0 else self.blackKingLocation
+        return bitCount(kingMasks[kingRow*9 + kingCol] & self.attackedSquares(-color))
+
+    '''
+    Moves without considering checks, packed as start square << 7 | end square like GameState.getAllPossibleMoves,
+    drops last with the empty squares of their drop mask
+    '''
+    def getAllPossibleMoves(self):
+        squares = self.squares
+        side = 1 if self.whiteToMove else 0
+        own = self.colors[side]
+        occupied = own | self.colors[1 - side]
+        moves = []
+        for start in bitSquares(own):
+            packedStart = start << 7
+            for end in bitSquares(self.attacksFrom(squares[start], start, occupied) & ~own):
+                moves.append(packedStart | end)
+        hand = self.hands[side]
+        if any(hand):
+            empty = FULL & ~occupied
+            for piece in ShogiEngine.handPieces:
+                if hand[piece]:
+                    targets = empty & dropMasks[side][piece]
+                    if piece == PAWN:
+                        targets &= ~pawnFileMasks[self.pawnFiles[side]]
+                    packedStart = (DROP + piece) << 7
+                    moves += [packedStart | end for end in bitSquares(targets)]
+        return moves
+
+    '''
+    Pieces pinned to the king of the player to move, as {square: squares the piece may move to without leaving the pin}
+    '''
+    def findPins(self, kingSquare, occupied):
+        squares = self.squares
+        sign = 1 if self.whiteToMove else -1
+        sliders = sliderSets[0 if self.whiteToMove else 1]
+        pins = {}
+        for direction in range(len(directions)):
+            blockers = rayMasks[direction][kingSquare] & occupied
+            if not blockers:
+                continue
+            positive = positiveDirection[direction]
+            first = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+            if squares[first] * sign <= 0:      #Nearest piece is not the users
+                continue
+            beyond = rayMasks[direction][first] & occupied
+            if not beyond:
+                continue
+            second = (beyond & -beyond).bit_length() - 1 if positive else beyond.bit_length() - 1
+            if -squares[second] * sign in sliders[direction]:
+                pins[first] = rayMasks[direction][kingSquare] & ~rayMasks[direction][second]
+        return pins
+
+    '''
+    All moves considering checks.
+    Pins and checks are found once, king moves are tested against every square the opponent attacks with the king lifted.
+    Drops only need an empty square in the way of a check, and a pawn drop that mates is left out like in GameState
+    '''
+    def getValidMoves(self):
+        squares = self.squares
+        sign = 1 if self.whiteToMove else -1
+        occupied = self.colors[0] | self.colors[1]
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSquare = kingRow*9 + kingCol
+        checkers = self.attackersTo(kingSquare, -sign, occupied)
+        pins = self.findPins(kingSquare, occupied)
+        danger = self.attackedSquares(-sign, occupied ^ (1 << kingSquare))
+
+        #Squares a non king move has to end on: the checker or a square between it and the king
+        allowed = FULL
+        if checkers:
+            allowed = 0 if checkers & (checkers - 1) else checkers      #Only the king can escape a double check
+            for direction in range(len(directions)):
+                if allowed and rayMasks[direction][kingSquare] & checkers:
+                    allowed = rayMasks[direction][kingSquare] & ~rayMasks[direction][checkers.bit_length() - 1]
+
+        enemyRow, enemyCol = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
+        checkSquare = (enemyRow + sign)*9 + enemyCol
+        pawnCheckDrop = (DROP + PAWN) << 7 | checkSquare if 0 <= checkSquare < 81 else -1
+
+        moves = []
+        for packed in self.getAllPossibleMoves():
+            start = packed >> 7
+            end = packed & 127
+            if start == kingSquare:
+                if danger >> end & 1:
+                    continue
+            else:
+                if not allowed >> end & 1:
+                    continue
+                pin = pins.get(start)
+                if pin is not None and not pin >> end & 1:
+                    continue
+                if start >= DROP:
+                    move = Move.drop((start - DROP) * sign, end)
+                    if packed == pawnCheckDrop and ShogiEngine.GameState.isPawnDropMate(self, move):
+                        continue
+                    moves.append(move)
+                    continue
+            moves.append(Move(start, end, squares))
+
+        if len(moves) == 0:
+            self.checkMate = checkers != 0
+            self.staleMate = checkers == 0
+        else:
+            self.checkMate = False
+            self.staleMate = False
+        return moves
@@ -0,0 +1,58 @@
+'''
+Move ordering for the alpha-beta search.
+Searching the best moves first makes cutoffs come early, so the order decides how much of the tree is skipped:
+stored best move, then captures by victim value minus attacker value, then killer moves, then the history table
+'''
+
+TT_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000      #Plus victim value minus attacker value, so every capture goes before the quiet moves
+KILLER_SCORES = (90000, 80000)
+MAX_PLY = 128
+
+
+class MoveOrderer():
+
+    def __init__(self, pieceScores, letters):
+        #Value of each piece type code, from the evaluation's table keyed by piece letter
+        self.values = [pieceScores.get(letter, 0) for letter in letters]
+        self.killers = [[None, None] for ply in range(MAX_PLY)]     #Two quiet moves per ply that caused a cutoff
+        self.history = [[0] * 81 for code in range(len(letters) * 2 - 1)]   #Cutoff credit per piece code and end square
+
+    def clear(self):
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        self.history = [[0] * 81 for code in range(len(self.history))]
+
+    '''
+    Moves sorted with the most promising first.
+    The sort is stable, so moves of equal score keep the order they were given in
+    '''
+    def orderMoves(self, moves, ply, ttMoveId=None):
+        values = self.values
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history
+
+        def moveScore(move):
+            if move.moveId == ttMoveId:
+                return TT_MOVE_SCORE
+            if move.pieceCapturedCode:
+                return CAPTURE_SCORE + values[abs(move.pieceCapturedCode)] - values[abs(move.pieceMovedCode)]
+            if move.moveId == killers[0]:
+                return KILLER_SCORES[0]
+            if move.moveId == killers[1]:
+                return KILLER_SCORES[1]
+            return history[move.pieceMovedCode][move.end]
+
+        return sorted(moves, key=moveScore, reverse=True)
+
+    '''
+    Remember a quiet move that failed high, deeper cutoffs count for more
+    '''
+    def recordCutoff(self, move, depth, ply):
+        if move.pieceCapturedCode:    #Captures are already ordered first
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move.moveId:
+                killers[1] = killers[0]
+                killers[0] = move.moveId
+        self.history[move.pieceMovedCode][move.end] += depth * depth
@@ -0,0 +1,160 @@
+'''
+Opening book: moves played from positions of the early game, looked up by Zobrist key.
+The book file is an 8 byte header followed by 12 byte entries (key, moveId, weight) sorted by key, so it is searched
+in place through mmap and every engine process shares the one page-cached copy.
+
+Build a book from game records, JSON lines as written by SelfPlay.py or lines of USI moves from the start position:
+python OpeningBook.py games.jsonl --output book.bin --plies 16
+'''
+import argparse
+import bisect
+import json
+import mmap
+import random
+import struct
+import sys
+import ShogiEngine
+
+MAGIC = b'SHOGIBK1'
+ENTRY = struct.Struct('<QHH')   #Zobrist key, moveId, weight
+KEY = struct.Struct('<Q')
+MAX_WEIGHT = 0xFFFF
+BOOK_PLIES = 16     #Moves of every game that go into the book
+
+
+class OpeningBook():
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:      #Empty file
+            self.file.close()
+            raise ValueError('Not an opening book: ' + path)
+        if self.data[:len(MAGIC)] != MAGIC or (len(self.data) - len(MAGIC)) % ENTRY.size:
+            self.close()
+            raise ValueError('Not an opening book: ' + path)
+        self.entries = (len(self.data) - len(MAGIC)) // ENTRY.size
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.entries
+
+    def keyAt(self, i):
+        return KEY.unpack_from(self.data, len(MAGIC) + i * ENTRY.size)[0]
+
+    '''
+    Book moves of a position as [(moveId, weight)], most played first
+    '''
+    def probe(self, key):
+        lo, hi = 0, self.entries
+        while lo < hi:      #First entry with a key not below key
+            mid = (lo + hi) // 2
+            if self.keyAt(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        moves = []
+        while lo < self.entries:
+            entryKey, moveId, weight = ENTRY.unpack_from(self.data, len(MAGIC) + lo * ENTRY.size)
+            if entryKey != key:
+                break
+            moves.append((moveId, weight))
+            lo += 1
+        return moves
+
+    '''
+    A valid book move of the position or None. Moves are drawn in proportion to their weight, or the most played one
+    is taken when randomize is False. Moves are checked against the valid moves, so a key collision can not play an illegal move
+    '''
+    def pickMove(self, gs, validMoves=None, randomize=True):
+        entries = self.probe(gs.zobristKey)
+        if not entries:
+            return None
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        byId = {move.moveId: move for move in validMoves}
+        entries = [(moveId, weight) for moveId, weight in entries if moveId in byId]
+        if not entries:
+            return None
+        if not randomize:
+            return byId[entries[0][0]]
+        cumulative = []
+        total = 0
+        for moveId, weight in entries:
+            total += weight
+            cumulative.append(total)
+        return byId[entries[bisect.bisect_right(cumulative, random.randrange(total))][0]]
+
+
+'''
+Moves of one game record line: (start SFEN or None, list of USI moves, number of leading random moves)
+'''
+def parseRecord(line):
+    line = line.strip()
+    if not line:
+        return None, [], 0
+    if line.startswith('{'):
+        record = json.loads(line)
+        return record.get('sfen'), record['moves'], record.get('randomPlies', 0)
+    return None, line.split(), 0
+
+'''
+Count how often every move was played from every position in the first plies of the games.
+Random opening moves of self-play games are played on the board but not counted, so the book only learns searched moves.
+Returns {(key, moveId): count}
+'''
+def countMoves(lines, plies=BOOK_PLIES):
+    counts = {}
+    for line in lines:
+        sfen, moves, randomPlies = parseRecord(line)
+        if not moves:
+            continue
+        gs = ShogiEngine.GameState() if sfen is None else ShogiEngine.GameState.fromSfen(sfen)
+        for ply, notation in enumerate(moves[:plies]):
+            try:
+                move = gs.parseMove(notation)
+            except ValueError:
+                break       #Rest of a broken record is left out
+            if ply >= randomPlies:
+                entry = (gs.zobristKey, move.moveId)
+                counts[entry] = counts.get(entry, 0) + 1
+            gs.makeMove(move)
+    return counts
+
+'''
+Write the book file, moves played fewer than minCount times are left out
+'''
+def writeBook(counts, path, minCount=1):
+    entries = sorted(((key, moveId, count) for (key, moveId), count in counts.items() if count >= minCount),
+                     key=lambda entry: (entry[0], -entry[2]))      #Most played move of a position first
+    with open(path, 'wb') as output:
+        output.write(MAGIC)
+        for key, moveId, count in entries:
+            output.write(ENTRY.pack(key, moveId, min(count, MAX_WEIGHT)))
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build an opening book from game records')
+    parser.add_argument('records', nargs='+', help='files of games, JSON lines from SelfPlay.py or lines of USI moves')
+    parser.add_argument('--output', default='book.bin', help='book file to write (default book.bin)')
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES, help='moves of every game to use (default %d)' % BOOK_PLIES)
+    parser.add_argument('--min-count', type=int, default=1, help='games a move must be played in to be kept (default 1)')
+    args = parser.parse_args(argv)
+
+    counts = {}
+    for path in args.records:
+        with open(path) as lines:
+            for entry, count in countMoves(lines, args.plies).items():
+                counts[entry] = counts.get(entry, 0) + count
+    entries = writeBook(counts, args.output, args.min_count)
+    print('%d book moves written to %s' % (entries, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
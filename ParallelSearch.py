@@ -0,0 +1,150 @@
+'''
+Root parallel search over several processes, so a search can use more than one core despite the GIL.
+The root moves are dealt out to the worker processes, every worker runs its own iterative deepening search on its
+share with its own transposition table, and the best move is taken from the deepest iteration all workers finished.
+With one worker the plain AIMoveFinder search is used, which is deterministic
+'''
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+import ShogiEngine
+import AIMoveFinder
+
+stopEvent = None    #Set by the parent to stop the searches of every worker process
+
+
+def initWorker(event, hashSizeMb):
+    global stopEvent
+    stopEvent = event
+    if hashSizeMb is not None:
+        AIMoveFinder.setHashSize(hashSizeMb)
+
+'''
+Search of the root moves given in USI notation, runs in a worker process.
+The root is the position after the played moves from sfen, so positions played before count for repetitions.
+options are more Searcher options. Returns (depth, score, pv notations) of every finished iteration and the node count
+'''
+def searchRootMoves(sfen, played, notations, timeLimitMs, maxDepth, nodeLimit, options):
+    gs = ShogiEngine.GameState.fromSfen(sfen)
+    for notation in played:
+        gs.makeMove(gs.parseMove(notation))
+    rootMoves = [move for move in gs.getValidMoves() if move.getShogiNotation() in notations]
+    iterations = []
+
+    def record(result):
+        iterations.append((result.depth, result.score, [move.getShogiNotation() for move in result.pv]))
+
+    searcher = AIMoveFinder.Searcher(gs, timeLimitMs, maxDepth, nodeLimit=nodeLimit, infoCallback=record, **options)
+    finished = threading.Event()
+
+    def watchStop():
+        while not finished.is_set():
+            if stopEvent is not None and stopEvent.wait(0.01):
+                searcher.stop()
+                return
+
+    watcher = threading.Thread(target=watchStop, daemon=True)
+    watcher.start()
+    result = searcher.search(rootMoves)
+    finished.set()
+    watcher.join()
+    return iterations, result.nodes
+
+'''
+Iteration of a worker at the given depth.
+A mate found earlier is proven, so it stands for every deeper iteration the worker did not need to run
+'''
+def iterationAt(iterations, depth):
+    for iteration in iterations:
+        if iteration[0] == depth:
+            return iteration
+    return iterations[-1]
+
+def isProven(iteration):
+    return abs(iteration[1]) >= AIMoveFinder.checkMate
+
+
+class ParallelSearcher():
+
+    '''
+    workers defaults to the number of cores, hashSizeMb is the transposition table size of every worker process.
+    A single worker searches in this process with the AIMoveFinder transposition table
+    '''
+    def __init__(self, workers=None, hashSizeMb=None):
+        self.workers = max(1, workers if workers is not None else (os.cpu_count() or 1))
+        self.hashSizeMb = hashSizeMb
+        self.stopEvent = multiprocessing.Event()
+        self.pool = None
+        self.searcher = None    #Searcher of a single worker search, so stop() reaches it
+
+    def start(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=initWorker,
+                                                               initargs=(self.stopEvent, self.hashSizeMb))
+
+    '''
+    Shut down the worker processes
+    '''
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.searcher is not None:
+            self.searcher.stop()
+
+    '''
+    Same arguments and SearchResult as AIMoveFinder.search, nodeLimit is shared out between the workers.
+    options are passed on to the Searcher of every worker
+    '''
+    def search(self, gs, timeLimitMs=None, maxDepth=AIMoveFinder.MAX_DEPTH, nodeLimit=None, **options):
+        self.stopEvent.clear()
+        validMoves = gs.getValidMoves()
+        result = AIMoveFinder.bookMove(gs, validMoves)
+        if result is not None:
+            return result
+        if self.workers == 1 or len(validMoves) <= 1:
+            self.searcher = AIMoveFinder.Searcher(gs, timeLimitMs, maxDepth, nodeLimit=nodeLimit, **options)
+            result = self.searcher.search(validMoves)
+            self.searcher = None
+            return result
+
+        startTime = time.perf_counter()
+        self.start()
+        if timeLimitMs is not None:     #Less the time taken to start the worker processes
+            timeLimitMs = max(1, timeLimitMs - (time.perf_counter() - startTime) * 1000)
+        #Dealt round robin in search order, so every worker gets some of the likely best moves
+        ordered = AIMoveFinder.MoveOrderer(AIMoveFinder.pieceScores, ShogiEngine.pieceLetters).orderMoves(validMoves, 0)
+        shares = [[move.getShogiNotation() for move in ordered[i::self.workers]] for i in range(min(self.workers, len(ordered)))]
+        workerNodeLimit = None if nodeLimit is None else max(1, nodeLimit // len(shares))
+        start = gs.copy()
+        while start.moveLog:
+            start.undoMove()
+        sfen = start.toSfen()
+        played = [move.getShogiNotation() for move in gs.moveLog]
+        futures = [self.pool.submit(searchRootMoves, sfen, played, share, timeLimitMs, maxDepth, workerNodeLimit, options)
+                   for share in shares]
+        answers = [future.result() for future in futures]
+
+        #Scores of different depths do not compare, so the deepest depth every unproven worker finished is used
+        depths = [iterations[-1][0] for iterations, nodes in answers if not isProven(iterations[-1])]
+        depth = min(depths) if depths else max(iterations[-1][0] for iterations, nodes in answers)
+        best = None
+        for iterations, nodes in answers:
+            iteration = iterationAt(iterations, depth)
+            if best is None or iteration[1] > best[1]:
+                best = iteration
+
+        pv = []
+        for notation in best[2]:
+            move = gs.parseMove(notation)
+            pv.append(move)
+            gs.makeMove(move)
+        for move in pv:
+            gs.undoMove()
+        nodes = sum(nodes for iterations, nodes in answers)
+        return AIMoveFinder.SearchResult(pv[0], best[1], best[0], pv, nodes, (time.perf_counter() - startTime) * 1000)
@@ -0,0 +1,293 @@
+'''
+Perft: counts the leaf nodes of the move tree to a fixed depth.
+Checks move generation against a table of known counts and measures its speed.
+Runs without pygame: python Perft.py [--depth N] [--position NAME] [--divide] [--bitboards]
+python Perft.py --differential GAMES compares getValidMoves with making and undoing every candidate move over random games
+python Perft.py --round-trip GAMES writes every position of random games as SFEN and as bytes and reads it back
+python Perft.py --incremental GAMES checks the position key and material kept by makeMove and undoMove against a full recompute
+'''
+import argparse
+import random
+import sys
+import time
+import ShogiEngine
+import Bitboards
+
+'''
+Test positions as rows of two character piece names or a SFEN string, player to move and the expected node count of every depth.
+The player to move of a SFEN position is the one in the string
+'''
+POSITIONS = {
+    'start': (None, True, [30, 900, 25440, 718565]),
+
+    #Pawns, silver, knight, lance, rook and bishop moving into the promotion rows of both players
+    'promotions': ([
+        '-- -- -- -- bK -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        'wp -- wS -- -- -- wL -- --',
+        '-- wN -- -- -- -- bN -- wR',
+        '-- -- -- bp -- -- bS -- --',
+        '-- bB -- -- -- -- -- -- bL',
+        'bR -- -- -- -- -- -- wB --',
+        '-- -- -- -- wK -- -- -- --'], True, [29, 967, 30704, 1076351]),
+
+    #Gold, silver and knight pinned to the white king by rook, bishop and promoted rook, silver pinned to the black king by a lance
+    'pins': ([
+        '-- -- -- -- -- -- -- -- bK',
+        '-- -- -- -- -- -- -- -- bS',
+        '-- -- -- -- bR -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        'bB -- -- -- -- -- -- -- --',
+        '-- -- -- -- -- -- -- -- wL',
+        '-- -- -- -- wG -- -- -- --',
+        '-- -- -- wS -- -- -- -- --',
+        '-- -- -- -- wK -- wN -- bO'], True, [11, 308, 4189, 155578]),
+
+    #Knights and lances on the edge files, blocked lances and knights that can only jump into the promotion rows
+    'edges': ([
+        'bL -- -- -- bK -- -- -- bL',
+        '-- -- -- -- -- -- -- -- --',
+        'bp -- -- -- -- -- -- -- --',
+        '-- -- -- -- -- -- -- -- wp',
+        'wN -- -- -- -- -- -- -- --',
+        'bN -- -- -- -- -- -- -- bp',
+        'wp -- -- -- -- -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        'wL -- -- -- wK -- -- wN wL'], True, [14, 165, 3551, 61195]),
+
+    #White king in double check from a rook and a knight, only king moves are legal
+    'double check': ([
+        '-- -- -- -- bK -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        '-- -- -- -- bR -- -- -- --',
+        '-- -- -- -- -- -- -- -- --',
+        '-- -- wG -- -- -- -- -- --',
+        '-- -- -- bN -- -- -- -- --',
+        '-- -- -- -- -- wG -- -- --',
+        '-- -- -- -- wK -- -- -- --'], True, [3, 66, 852, 18940]),
+
+    #Bishops traded off after 7g7f 3c3d 8h2b+ 3a2b, both players can drop one
+    'bishop exchange': ('lnsgkg1nl/1r5s1/pppppp1pp/6p2/9/2P6/PP1PPPPPP/7R1/LNSGKGSNL b Bb 5', True, [77, 5390, 276693]),
+
+    #Dropping the pawn on 5b would mate the boxed in black king, which is not allowed
+    'pawn drop mate': ('3lkl3/3s1s3/4G4/9/9/9/9/9/4K4 b P 1', True, [78, 606, 9811, 256154]),
+
+    #White king in check from a rook with one piece of every type in hand, only drops between them and king moves are legal
+    'drops in check': ('4k4/9/9/9/4r4/9/9/9/4K4 b RBGSNL2Pp 1', True, [25, 2137, 949640]),
+}
+
+
+def loadPosition(name, bitboards=False):
+    rows, whiteToMove, counts = POSITIONS[name]
+    if isinstance(rows, str):
+        gs = ShogiEngine.GameState.fromSfen(rows)
+    else:
+        gs = ShogiEngine.GameState(None if rows is None else [row.split() for row in rows], whiteToMove)
+    return Bitboards.BitboardState.fromGameState(gs) if bitboards else gs
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:      #Leaves are counted without making them
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+'''
+Node count below every root move, to find which move a wrong total comes from
+'''
+def divide(gs, depth):
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getShogiNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+'''
+Valid moves found the slow way, the reference of the differential test, the way getValidMoves used to find them:
+every candidate of getAllPossibleMoves is made and kept unless a candidate move of the other player ends on the king.
+Attacks are not looked up in the tables getValidMoves uses, so a mistake in those shows up as a difference.
+A pawn dropped right in front of the enemy king gives check, and is left out when the other player has no reply
+'''
+def referenceMoves(gs, pawnDropMate=True):
+    sign = 1 if gs.whiteToMove else -1
+    moves = []
+    for packed in gs.getAllPossibleMoves():
+        start = packed >> 7
+        end = packed & 127
+        if start >= ShogiEngine.DROP:
+            move = ShogiEngine.Move.drop((start - ShogiEngine.DROP) * sign, end)
+        else:
+            move = ShogiEngine.Move(start, end, gs.squares)
+        gs.makeMove(move)
+        kingRow, kingCol = gs.whiteKingLocation if sign > 0 else gs.blackKingLocation
+        valid = not any(reply & 127 == kingRow*9 + kingCol for reply in gs.getAllPossibleMoves())
+        if valid and pawnDropMate and start == ShogiEngine.DROP + ShogiEngine.PAWN:
+            enemyRow, enemyCol = gs.blackKingLocation if sign > 0 else gs.whiteKingLocation
+            if enemyRow*9 + enemyCol == end - 9*sign:      #Pawns move towards the enemy side, row 0 for white
+                valid = len(referenceMoves(gs, False)) > 0
+        gs.undoMove()
+        if valid:
+            moves.append(move)
+    return moves
+
+'''
+Random move of the random games, a capture half of the time when there is one so the hands fill up
+'''
+def randomMove(rng, moves):
+    captures = [move for move in moves if move.pieceCapturedCode != ShogiEngine.EMPTY]
+    return rng.choice(captures if captures and rng.random() < 0.5 else moves)
+
+'''
+Plays random games from the start position and compares the valid moves of every position with referenceMoves.
+Returns the number of positions that differ
+'''
+def differential(games, seed, maxPlies, bitboards=False):
+    rng = random.Random(seed)
+    positions = 0
+    moveCount = 0
+    failures = 0
+    for game in range(games):
+        gs = ShogiEngine.GameState()
+        for ply in range(maxPlies):
+            generator = Bitboards.BitboardState.fromGameState(gs) if bitboards else gs
+            moves = generator.getValidMoves()
+            expected = referenceMoves(gs)
+            positions += 1
+            moveCount += len(expected)
+            found = set(move.getShogiNotation() for move in moves)
+            wanted = set(move.getShogiNotation() for move in expected)
+            if found != wanted or len(moves) != len(expected):
+                failures += 1
+                print('FAIL game %d ply %d %s: missing %s extra %s' % (game, ply, gs.toSfen(), ' '.join(sorted(wanted - found)),
+                                                                     ' '.join(sorted(found - wanted))))
+            if not expected:
+                break
+            gs.makeMove(randomMove(rng, expected))
+    print('differential %d games, %d positions, %d moves, %d positions differ' % (games, positions, moveCount, failures))
+    return failures
+
+'''
+What a position read back has to keep of the one written
+'''
+def positionState(gs):
+    return gs.squares, gs.whiteToMove, gs.hands, gs.startMoveNumber + len(gs.moveLog), gs.zobristKey, gs.material
+
+'''
+Plays random games and reads every position back from toSfen and from toBytes, which have to give the same position
+and write the same string and bytes again. Returns the number of positions that differ
+'''
+def roundTrip(games, seed, maxPlies):
+    rng = random.Random(seed)
+    positions = 0
+    failures = 0
+    for game in range(games):
+        gs = ShogiEngine.GameState()
+        for ply in range(maxPlies):
+            sfen = gs.toSfen()
+            data = gs.toBytes()
+            fromSfen = ShogiEngine.GameState.fromSfen(sfen)
+            fromBytes = ShogiEngine.GameState.fromBytes(data)
+            positions += 1
+            wrong = [name for name, ok in (('sfen', positionState(fromSfen) == positionState(gs) and fromSfen.toSfen() == sfen),
+                                           ('bytes', positionState(fromBytes) == positionState(gs) and fromBytes.toBytes() == data)) if not ok]
+            if wrong:
+                failures += 1
+                print('FAIL game %d ply %d %s: %s' % (game, ply, sfen, ' '.join(wrong)))
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(randomMove(rng, moves))
+    print('round trip %d games, %d positions, %d positions differ' % (games, positions, failures))
+    return failures
+
+'''
+Plays random games, then takes every move back, and checks after every move made or undone that the zobristKey kept up to date
+by makeMove and undoMove equals computeZobristKey, and the material computeMaterial. Returns the number of positions that differ
+'''
+def incremental(games, seed, maxPlies):
+    rng = random.Random(seed)
+    positions = 0
+    failures = 0
+
+    def check(gs, game, action):
+        wrong = [name for name, kept, computed in (('zobristKey', gs.zobristKey, gs.computeZobristKey()),
+                                                   ('material', gs.material, gs.computeMaterial())) if kept != computed]
+        if wrong:
+            print('FAIL game %d %s ply %d %s: %s' % (game, action, len(gs.moveLog), gs.toSfen(), ' '.join(wrong)))
+            return 1
+        return 0
+
+    for game in range(games):
+        gs = ShogiEngine.GameState()
+        for ply in range(maxPlies):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(randomMove(rng, moves))
+            positions += 1
+            failures += check(gs, game, 'after making')
+        while gs.moveLog:
+            gs.undoMove()
+            positions += 1
+            failures += check(gs, game, 'after undoing')
+    print('incremental %d games, %d positions, %d positions differ' % (games, positions, failures))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count and time the move tree of the test positions')
+    parser.add_argument('--depth', type=int, default=3, help='deepest depth to run (default 3)')
+    parser.add_argument('--position', choices=sorted(POSITIONS), help='run a single position')
+    parser.add_argument('--divide', action='store_true', help='print the node count of every root move at the deepest depth')
+    parser.add_argument('--bitboards', action='store_true', help='generate moves with the bitboard backend')
+    parser.add_argument('--differential', type=int, metavar='GAMES', help='compare the move generator with making every move over random games')
+    parser.add_argument('--round-trip', type=int, metavar='GAMES', help='read every position of random games back from SFEN and bytes')
+    parser.add_argument('--incremental', type=int, metavar='GAMES', help='check the position key and material kept by makeMove and undoMove over random games')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random games (default 0)')
+    parser.add_argument('--max-plies', type=int, default=200, help='plies of every random game at most (default 200)')
+    args = parser.parse_args(argv)
+
+    if args.differential is not None:
+        return 1 if differential(args.differential, args.seed, args.max_plies, args.bitboards) else 0
+    if args.round_trip is not None:
+        return 1 if roundTrip(args.round_trip, args.seed, args.max_plies) else 0
+    if args.incremental is not None:
+        return 1 if incremental(args.incremental, args.seed, args.max_plies) else 0
+
+    failed = False
+    totalNodes = 0
+    totalTime = 0.0
+    for name in ([args.position] if args.position else POSITIONS):
+        expected = POSITIONS[name][2]
+        for depth in range(1, args.depth + 1):
+            gs = loadPosition(name, args.bitboards)
+            startTime = time.perf_counter()
+            nodes = perft(gs, depth)
+            seconds = time.perf_counter() - startTime
+            totalNodes += nodes
+            totalTime += seconds
+            if depth <= len(expected):
+                status = 'ok' if nodes == expected[depth - 1] else 'FAIL expected ' + str(expected[depth - 1])
+                failed = failed or nodes != expected[depth - 1]
+            else:
+                status = 'no expected count'
+            print('%-16s depth %d %10d nodes %8.3fs %9d nodes/s  %s' % (name, depth, nodes, seconds, nodes / seconds if seconds else 0, status))
+        if args.divide:
+            for notation, nodes in divide(loadPosition(name, args.bitboards), args.depth).items():
+                print('  %-6s %d' % (notation, nodes))
+    print('total %d nodes in %.3fs, %d nodes/s' % (totalNodes, totalTime, totalNodes / totalTime if totalTime else 0))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+'''
+Statistics of one search: nodes and leaf evaluations per ply, cutoffs, transposition table use and where the time went,
+with optional profiling of the search and a JSON dump for comparing runs
+'''
+import collections
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+
+PROFILE_LINES = 25      #Functions kept from a profile
+SAMPLE_INTERVAL = 0.001     #Seconds between samples of the sampling profiler
+
+
+class SearchStats():
+
+    def __init__(self):
+        self.nodesByPly = collections.Counter()      #Alpha-beta and capture search nodes entered at each ply
+        self.leafEvaluationsByPly = collections.Counter()    #Static evaluations at each ply
+        self.quiescenceNodes = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0   #Cutoffs by the first move searched, the higher the better the move ordering
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.ttCutoffs = 0
+        self.repetitions = 0    #Moves scored as repetitions of an earlier position instead of searched
+        self.nullMoves = 0      #Passed turns searched for null-move pruning
+        self.nullMoveCutoffs = 0
+        self.reductions = 0     #Late moves searched shallower
+        self.reSearches = 0     #Zero window and reduced searches that beat alpha and were searched again
+        self.moveGenTime = 0.0      #Seconds spent in getValidMoves
+        self.evalTime = 0.0     #Seconds spent scoring positions
+        self.totalTime = 0.0
+        self.iterations = []    #(depth, score, nodes, milliseconds) of every finished iteration
+        self.profile = None     #Lines of the busiest functions when the search was profiled
+
+    def nodes(self):
+        return sum(self.nodesByPly.values())
+
+    def leafEvaluations(self):
+        return sum(self.leafEvaluationsByPly.values())
+
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes else 0.0
+
+    def nodesPerSecond(self):
+        return self.nodes() / self.totalTime if self.totalTime > 0 else 0.0
+
+    def toDict(self):
+        return {'nodes': self.nodes(),
+                'nodesByPly': {str(ply): count for ply, count in sorted(self.nodesByPly.items())},
+                'leafEvaluations': self.leafEvaluations(),
+                'leafEvaluationsByPly': {str(ply): count for ply, count in sorted(self.leafEvaluationsByPly.items())},
+                'quiescenceNodes': self.quiescenceNodes,
+                'betaCutoffs': self.betaCutoffs,
+                'firstMoveCutoffRate': round(self.firstMoveCutoffRate(), 4),
+                'ttProbes': self.ttProbes,
+                'ttHitRate': round(self.ttHitRate(), 4),
+                'ttCutoffs': self.ttCutoffs,
+                'repetitions': self.repetitions,
+                'nullMoves': self.nullMoves,
+                'nullMoveCutoffs': self.nullMoveCutoffs,
+                'reductions': self.reductions,
+                'reSearches': self.reSearches,
+                'moveGenSeconds': round(self.moveGenTime, 4),
+                'evalSeconds': round(self.evalTime, 4),
+                'totalSeconds': round(self.totalTime, 4),
+                'nodesPerSecond': round(self.nodesPerSecond()),
+                'iterations': [{'depth': depth, 'score': score, 'nodes': nodes, 'timeMs': round(timeMs, 1)}
+                               for depth, score, nodes, timeMs in self.iterations],
+                'profile': self.profile}
+
+    def dump(self, path):
+        with open(path, 'w') as output:
+            json.dump(self.toDict(), output, indent=2)
+
+    '''
+    A few lines for a terminal
+    '''
+    def summary(self):
+        lines = ['nodes %d (%d capture search)  leaf evaluations %d  %.0f nodes/s' % (self.nodes(), self.quiescenceNodes,
+                                                                                       self.leafEvaluations(), self.nodesPerSecond()),
+                 'beta cutoffs %d, %.1f%% by the first move  tt hits %.1f%% of %d probes, %d cutoffs' % (
+                     self.betaCutoffs, self.firstMoveCutoffRate() * 100, self.ttHitRate() * 100, self.ttProbes, self.ttCutoffs),
+                 'null moves %d, %d cutoffs  reductions %d  re-searches %d  repetitions %d' % (
+                     self.nullMoves, self.nullMoveCutoffs, self.reductions, self.reSearches, self.repetitions),
+                 'time %.3fs: move generation %.3fs, evaluation %.3fs' % (self.totalTime, self.moveGenTime, self.evalTime),
+                 'nodes by ply ' + ' '.join('%d:%d' % item for item in sorted(self.nodesByPly.items()))]
+        return '\n'.join(lines)
+
+
+'''
+Samples the stack of a thread at a fixed interval and counts the innermost functions seen.
+Slows the search far less than cProfile, which times every call. The sampler needs the GIL to run,
+so samples come about every sys.getswitchinterval() seconds (5 ms by default) however short the interval
+'''
+class SamplingProfiler():
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, threadId=None):
+        threadId = threading.get_ident() if threadId is None else threadId
+        self.thread = threading.Thread(target=self.run, args=(threadId,), daemon=True)
+        self.thread.start()
+
+    def run(self, threadId):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(threadId)
+            if frame is not None:
+                code = frame.f_code
+                self.samples['%s:%d(%s)' % (code.co_filename.split('/')[-1], code.co_firstlineno, code.co_name)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def lines(self, count=PROFILE_LINES):
+        total = sum(self.samples.values())
+        if total == 0:
+            return []
+        return ['%5.1f%%  %s' % (samples * 100 / total, name) for name, samples in self.samples.most_common(count)]
+
+
+class CProfileProfiler():
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def lines(self, count=PROFILE_LINES):
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats('tottime').print_stats(count)
+        return [line for line in output.getvalue().splitlines() if line.strip()]
+
+
+'''
+Profiler for a search by name: 'cprofile' or 'sample'. Returns an object with start(), stop() and lines()
+'''
+def makeProfiler(kind):
+    if kind == 'cprofile':
+        return CProfileProfiler()
+    if kind == 'sample':
+        return SamplingProfiler()
+    raise ValueError('Unknown profiler: ' + kind)
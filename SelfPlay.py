@@ -0,0 +1,183 @@
+'''
+Self-play game generator.
+Plays engine against engine over a pool of processes and writes every game as one JSON line as soon as it ends,
+so runs of any length keep nothing but the games in progress in memory:
+python SelfPlay.py --games 100 --workers 8 --white-depth 2 --black-time 200 --output games.jsonl
+'''
+import argparse
+import concurrent.futures
+import json
+import random
+import sys
+import time
+import ShogiEngine
+import AIMoveFinder
+from TranspositionTable import TranspositionTable
+
+MAX_PLIES = 300     #Games still running after this many plies are adjudicated drawn
+PENDING_PER_WORKER = 2  #Games queued ahead for every worker, so no worker waits for the parent
+
+
+'''
+Search settings of one player, None turns a limit off and off names the parts of the search the player goes without
+'''
+def sideSettings(depth, timeMs, off=()):
+    if depth is None and timeMs is None:
+        depth = AIMoveFinder.DEPTH
+    settings = {'maxDepth': depth if depth is not None else AIMoveFinder.MAX_DEPTH, 'timeLimitMs': timeMs}
+    for name in off:
+        settings[AIMoveFinder.SEARCH_FEATURES[name]] = False
+    return settings
+
+'''
+One game from the start position, or from sfen.
+The first randomPlies plies are random moves drawn from seed, so games vary while staying reproducible.
+Returns the game record as a dict
+'''
+def playGame(gameIndex, white, black, randomPlies, maxPlies, seed, sfen=None):
+    gs = ShogiEngine.GameState() if sfen is None else ShogiEngine.GameState.fromSfen(sfen)
+    startSfen = gs.toSfen()
+    rng = random.Random(seed)
+    #Each player has a table of its own, so a player never uses what a search with other settings stored
+    tables = {True: TranspositionTable(), False: TranspositionTable()}
+    moves = []
+    nodes = 0
+    searchMs = 0.0
+    validMoves = gs.getValidMoves()
+    while validMoves and len(moves) < maxPlies and gs.repetitionCount() < ShogiEngine.SENNICHITE_COUNT:
+        if len(moves) < randomPlies:
+            move = rng.choice(validMoves)
+        else:
+            settings = white if gs.whiteToMove else black
+            result = AIMoveFinder.search(gs, validMoves=validMoves, transpositionTable=tables[gs.whiteToMove], **settings)
+            move = result.bestMove
+            nodes += result.nodes
+            searchMs += result.timeMs
+        gs.makeMove(move)
+        moves.append(move.getShogiNotation())
+        validMoves = gs.getValidMoves()
+
+    if gs.checkMate:
+        winner, reason = ('black' if gs.whiteToMove else 'white'), 'checkmate'
+    elif gs.staleMate:
+        winner, reason = None, 'stalemate'
+    elif gs.repetitionCount() >= ShogiEngine.SENNICHITE_COUNT:
+        state = gs.repetition()
+        if state == ShogiEngine.SENNICHITE:
+            winner, reason = None, 'sennichite'
+        else:       #The side that gave check on every move of the repetition loses
+            mover = 'white' if gs.whiteToMove else 'black'
+            winner = mover if state == ShogiEngine.PERPETUAL_CHECK_WIN else ('black' if gs.whiteToMove else 'white')
+            reason = 'perpetual check'
+    else:
+        winner, reason = None, 'max plies'
+    return {'game': gameIndex, 'seed': seed, 'sfen': startSfen, 'moves': moves, 'randomPlies': min(randomPlies, len(moves)),
+            'winner': winner, 'reason': reason, 'plies': len(moves), 'nodes': nodes, 'searchMs': round(searchMs)}
+
+
+class GameWriter():
+
+    def __init__(self, output):
+        self.output = output
+        self.games = 0
+        self.nodes = 0
+        self.searchMs = 0.0
+        self.results = {'white': 0, 'black': 0, None: 0}
+        self.startTime = time.perf_counter()
+
+    def write(self, record):
+        self.output.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.output.flush()
+        self.games += 1
+        self.nodes += record['nodes']
+        self.searchMs += record['searchMs']
+        self.results[record['winner']] += 1
+
+    def gamesPerHour(self):
+        seconds = time.perf_counter() - self.startTime
+        return self.games * 3600 / seconds if seconds > 0 else 0
+
+    def nodesPerSecond(self):
+        return self.nodes * 1000 / self.searchMs if self.searchMs > 0 else 0
+
+    def report(self):
+        return '%d games  white %d  black %d  draws %d  %.0f games/hour  %.0f nodes/s' % (
+            self.games, self.results['white'], self.results['black'], self.results[None], self.gamesPerHour(), self.nodesPerSecond())
+
+
+'''
+Play the games over workers processes and hand each record to writer as it ends.
+A single worker plays in this process
+'''
+def run(games, workers, writer, white, black, randomPlies, maxPlies, seed, sfen=None, progress=None):
+    jobs = ((index, white, black, randomPlies, maxPlies, seed + index, sfen) for index in range(games))
+    if workers <= 1:
+        for job in jobs:
+            writer.write(playGame(*job))
+            if progress is not None:
+                progress(writer)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for job in jobs:
+            pending.add(pool.submit(playGame, *job))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    writer.write(future.result())
+                    if progress is not None:
+                        progress(writer)
+        for future in concurrent.futures.as_completed(pending):
+            writer.write(future.result())
+            if progress is not None:
+                progress(writer)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play engine games against itself and write them as JSON lines')
+    parser.add_argument('--games', type=int, default=10, help='number of games (default 10)')
+    parser.add_argument('--workers', type=int, default=1, help='processes playing games at the same time (default 1)')
+    parser.add_argument('--white-depth', type=int, help='search depth of white (default %d without a time)' % AIMoveFinder.DEPTH)
+    parser.add_argument('--white-time', type=int, help='time per move of white in milliseconds')
+    parser.add_argument('--black-depth', type=int, help='search depth of black (default %d without a time)' % AIMoveFinder.DEPTH)
+    parser.add_argument('--black-time', type=int, help='time per move of black in milliseconds')
+    parser.add_argument('--white-off', nargs='*', default=[], choices=sorted(AIMoveFinder.SEARCH_FEATURES),
+                        help='parts of the search white plays without')
+    parser.add_argument('--black-off', nargs='*', default=[], choices=sorted(AIMoveFinder.SEARCH_FEATURES),
+                        help='parts of the search black plays without')
+    parser.add_argument('--random-plies', type=int, default=4, help='random opening moves of every game (default 4)')
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES, help='plies after which a game is drawn (default %d)' % MAX_PLIES)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, game i uses seed + i (default 0)')
+    parser.add_argument('--sfen', help='start every game from this SFEN position')
+    parser.add_argument('--output', help='file the games are appended to (default standard output)')
+    parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    args = parser.parse_args(argv)
+
+    white = sideSettings(args.white_depth, args.white_time, args.white_off)
+    black = sideSettings(args.black_depth, args.black_time, args.black_off)
+    if args.sfen is not None:
+        try:
+            ShogiEngine.GameState.fromSfen(args.sfen)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    def progress(writer):
+        if not args.quiet:
+            print(writer.report(), file=sys.stderr)
+
+    output = sys.stdout if args.output is None else open(args.output, 'a')
+    try:
+        writer = GameWriter(output)
+        run(args.games, args.workers, writer, white, black, args.random_plies, args.max_plies, args.seed, args.sfen, progress)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if args.quiet:      #Otherwise the last progress line is the summary
+        print(writer.report(), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
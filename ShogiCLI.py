@@ -0,0 +1,98 @@
+'''
+Headless engine entry point.
+Loads a position, runs a search and prints the result without pygame or a display:
+python ShogiCLI.py --moves 7g7f 3c3d --time 1000
+python ShogiCLI.py --sfen "lnsgkgsnl/1r5b1/ppppppppp/9/9/2P6/PP1PPPPPP/1B5R1/LNSGKGSNL w - 2" --depth 3
+'''
+import argparse
+import sys
+import ShogiEngine
+import AIMoveFinder
+import ParallelSearch
+
+
+def loadPosition(moves, sfen=None):
+    gs = ShogiEngine.GameState() if sfen is None else ShogiEngine.GameState.fromSfen(sfen)
+    for notation in moves:
+        gs.makeMove(gs.parseMove(notation))
+    return gs
+
+
+def printBoard(gs):
+    for row in gs.board:
+        print(' '.join(row))
+    print(('White' if gs.whiteToMove else 'Black') + ' to move')
+    print('sfen ' + gs.toSfen())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search a Shogi position without the GUI')
+    parser.add_argument('--sfen', help='start from this SFEN position instead of the start position')
+    parser.add_argument('--moves', nargs='*', default=[], help='moves from the start position in USI notation, e.g. 7g7f 3c3d')
+    parser.add_argument('--depth', type=int, help='search depth (default %d without --time)' % AIMoveFinder.DEPTH)
+    parser.add_argument('--time', type=int, help='time limit in milliseconds')
+    parser.add_argument('--hash', type=int, help='transposition table size in megabytes')
+    parser.add_argument('--book', help='opening book file built by OpeningBook.py')
+    parser.add_argument('--workers', type=int, default=1, help='processes searching the root moves in parallel (default 1)')
+    parser.add_argument('--batch-eval', action='store_true', help='score the last ply with the NumPy batch evaluation (needs numpy, one worker)')
+    parser.add_argument('--stats', action='store_true', help='print the search statistics (one worker)')
+    parser.add_argument('--stats-json', help='write the search statistics to this JSON file (one worker)')
+    parser.add_argument('--profile', choices=('cprofile', 'sample'), help='profile the search and add the busiest functions to the statistics')
+    parser.add_argument('--show', action='store_true', help='print the board before searching')
+    parser.add_argument('--off', nargs='*', default=[], choices=sorted(AIMoveFinder.SEARCH_FEATURES),
+                        help='parts of the search to turn off, to compare searches with and without them')
+    args = parser.parse_args(argv)
+
+    try:
+        gs = loadPosition(args.moves, args.sfen)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.show:
+        printBoard(gs)
+    if args.hash is not None:
+        AIMoveFinder.setHashSize(args.hash)
+    if args.book is not None:
+        try:
+            AIMoveFinder.setOpeningBook(args.book)
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    if args.depth is None:
+        maxDepth = AIMoveFinder.DEPTH if args.time is None else AIMoveFinder.MAX_DEPTH
+    else:
+        maxDepth = args.depth
+    features = {AIMoveFinder.SEARCH_FEATURES[name]: False for name in args.off}
+    if args.workers > 1:
+        searcher = ParallelSearch.ParallelSearcher(args.workers, args.hash)
+        try:
+            result = searcher.search(gs, timeLimitMs=args.time, maxDepth=maxDepth, **features)
+        finally:
+            searcher.close()
+    else:
+        leafScorer = None
+        if args.batch_eval:
+            import BatchEvaluation     #numpy is only needed for this option
+            leafScorer = BatchEvaluation.scoreChildren
+        result = AIMoveFinder.search(gs, timeLimitMs=args.time, maxDepth=maxDepth, leafScorer=leafScorer, profiler=args.profile,
+                                     **features)
+    if result.bestMove is None:
+        print('no valid moves: ' + ('checkmate' if gs.checkMate else 'stalemate'))
+        return 0
+
+    print('bestmove %s score %g depth %d nodes %d time %dms nps %d' % (result.bestMove.getShogiNotation(), result.score, result.depth,
+                                                                      result.nodes, result.timeMs, result.nodesPerSecond()))
+    print('pv ' + ' '.join(move.getShogiNotation() for move in result.pv))
+    if result.stats is not None:
+        if args.stats:
+            print(result.stats.summary())
+            for line in result.stats.profile or []:
+                print(line)
+        if args.stats_json is not None:
+            result.stats.dump(args.stats_json)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
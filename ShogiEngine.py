@@ -3,14 +3,236 @@ Storing information about current state of the game.
 Determining valid moves at current state
 Keep a move log
 '''
+import random
+
+'''
+Piece codes of the flat board.
+A square holds EMPTY, the positive code of a white piece or the negative code of a black piece
+'''
+EMPTY = 0
+PAWN = 1
+LANCE = 2
+KNIGHT = 3
+SILVER = 4
+GOLD = 5
+BISHOP = 6
+ROOK = 7
+KING = 8
+PROM_BISHOP = 9
+PROM_ROOK = 10
+#Promoted Pawn, Lance, Knight and Silver move like a Gold General and are drawn as one, but are kept apart for SFEN
+PROM_PAWN = 11
+PROM_LANCE = 12
+PROM_KNIGHT = 13
+PROM_SILVER = 14
+
+pieceLetters = ['-', 'p', 'L', 'N', 'S', 'G', 'B', 'R', 'K', 'H', 'O', 'G', 'G', 'G', 'G']     #Letter used by the board view for every piece code
+
+#Indexed by piece code, negative (black) codes wrap round to the end of the list
+pieceNames = ['--'] + ['w' + letter for letter in pieceLetters[1:]] + ['b' + letter for letter in reversed(pieceLetters[1:])]
+pieceCodes = {pieceNames[code]: code for code in range(-PROM_ROOK, PROM_ROOK + 1)}
+
+minorPromotions = (PAWN, SILVER, LANCE, KNIGHT)     #Pieces promoted to Gold General
+promotedPieces = {PAWN: PROM_PAWN, LANCE: PROM_LANCE, KNIGHT: PROM_KNIGHT, SILVER: PROM_SILVER, ROOK: PROM_ROOK, BISHOP: PROM_BISHOP}
+
+'''
+SFEN piece letters. Uppercase pieces belong to the player who moves first (sente), which is white here,
+and ranks a to i are rows 0 to 8 with file 9 in column 0
+'''
+sfenLetters = ['', 'P', 'L', 'N', 'S', 'G', 'B', 'R', 'K', '+B', '+R', '+P', '+L', '+N', '+S']
+#Squares every SFEN character stands for, promoted pieces are looked up by the letter after the +
+sfenRuns = {str(count): [EMPTY] * count for count in range(1, 10)}
+sfenPromotedRuns = {}
+for code in range(1, len(sfenLetters)):
+    runs = sfenPromotedRuns if sfenLetters[code][0] == '+' else sfenRuns
+    runs[sfenLetters[code][-1]] = [code]
+    runs[sfenLetters[code][-1].lower()] = [-code]
+sfenPieces = sfenLetters + [letter.lower() for letter in reversed(sfenLetters[1:])]     #Indexed by piece code like pieceNames
+START_SFEN = 'lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1'
+
+pieceScores = {'K': 0, 'O': 15, 'H': 15, 'R': 10, 'B': 10, 'G': 5, 'S': 5, 'N': 3, 'L': 2, 'p': 1}
+#Score of every piece code, white positive and black negative (negative codes wrap round like pieceNames)
+codeScores = [0] + [pieceScores[letter] for letter in pieceLetters[1:]] + [-pieceScores[letter] for letter in reversed(pieceLetters[1:])]
+
+'''
+Code a piece becomes when it moves onto a square, 0 where it does not promote.
+Indexed by piece code like pieceNames and then by end square. Moves ending in the last three rows of the opponent are promoted
+'''
+promotionCodes = [[0] * 81 for code in range(len(pieceNames))]
+for piece, promoted in promotedPieces.items():
+    for sq in range(27):
+        promotionCodes[piece][sq] = promoted
+        promotionCodes[-piece][80 - sq] = -promoted
+
+'''
+Pieces in hand. A captured piece goes to the hand of the capturer as its unpromoted type, and instead of moving a player
+may drop a piece from the hand onto an empty square. Drops are packed like moves, with DROP plus the piece type in place of the start square
+'''
+DROP = 81
+NULL = -1       #Start of the null move, a pass of the turn used by the search
+MAX_BYTES_MOVE_NUMBER = (1 << 15) - 1     #Largest move number toBytes can store, it has 15 bits
+handPieces = (ROOK, BISHOP, GOLD, SILVER, KNIGHT, LANCE, PAWN)     #Pieces that can be held, in SFEN order
+#Type a captured piece goes into the hand as, indexed by piece code like pieceNames
+handTypes = [0] * len(pieceNames)
+for piece in handPieces:
+    handTypes[piece] = handTypes[-piece] = piece
+for piece, promoted in promotedPieces.items():
+    handTypes[promoted] = handTypes[-promoted] = piece
+
+'''
+dropRanges[color][piece] is the (first, last + 1) range of squares a piece may be dropped on, which leaves out the last row
+for Pawns and Lances and the last two rows for Knights, where they could never move again.
+fileBits[square] is the bit of the square's column in the per-file pawn masks that rule out two unpromoted pawns of a player on a file
+'''
+deadRows = {PAWN: 1, LANCE: 1, KNIGHT: 2}
+dropRanges = ({piece: (0, 81 - deadRows.get(piece, 0) * 9) for piece in handPieces},
+              {piece: (deadRows.get(piece, 0) * 9, 81) for piece in handPieces})
+fileBits = [1 << (sq % 9) for sq in range(81)]
+
+'''
+Move offsets of every piece as seen by white.
+Black uses the same offsets with the row direction flipped
+'''
+orthogonals = ((-1,0), (0,-1), (1,0), (0,1))     #Up, left, down, right
+diagonals = ((-1, -1), (-1, 1), (1, -1), (1, 1))    #Four corners
+knightMoves = ((-2,-1), (-2,1))
+silvGenMoves = ((-1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1))
+goldGenMoves = ((-1, 0), (-1, -1), (-1, 1), (0, -1), (0, 1), (1,0))
+kingMoves = ((-1,0),(1,0),(-1,1),(1,1),(0,1),(-1,-1),(0,-1),(1,-1))
+promRookMoves = diagonals
+promBishopMoves = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+def flipOffsets(offsets):
+    return tuple((-dr, dc) for dr, dc in offsets)
+
+#Single step offsets of each piece, black offsets first and white offsets second
+stepOffsets = {PAWN: (((1, 0),), ((-1, 0),)),
+               KNIGHT: (flipOffsets(knightMoves), knightMoves),
+               SILVER: (flipOffsets(silvGenMoves), silvGenMoves),
+               GOLD: (flipOffsets(goldGenMoves), goldGenMoves),
+               PROM_PAWN: (flipOffsets(goldGenMoves), goldGenMoves),
+               PROM_LANCE: (flipOffsets(goldGenMoves), goldGenMoves),
+               PROM_KNIGHT: (flipOffsets(goldGenMoves), goldGenMoves),
+               PROM_SILVER: (flipOffsets(goldGenMoves), goldGenMoves),
+               KING: (kingMoves, kingMoves),
+               PROM_ROOK: (promRookMoves, promRookMoves),
+               PROM_BISHOP: (promBishopMoves, promBishopMoves)}
+
+#Sliding directions of each piece, black directions first and white directions second
+slideDirections = {LANCE: (((1, 0),), ((-1, 0),)),
+                   ROOK: (orthogonals, orthogonals),
+                   PROM_ROOK: (orthogonals, orthogonals),
+                   BISHOP: (diagonals, diagonals),
+                   PROM_BISHOP: (diagonals, diagonals)}
+
+'''
+Reverse tables for attack detection, black attackers first and white attackers second.
+stepAttacks holds (dr, dc, pieces): a piece in pieces standing dr, dc away from a square attacks it.
+slideAttacks maps a direction to the sliding pieces which attack back along it from the first piece met.
+'''
+def buildStepAttacks(color):
+    attacks = {}
+    for piece, offsets in stepOffsets.items():
+        for dr, dc in offsets[color]:
+            attacks.setdefault((-dr, -dc), set()).add(piece)
+    return tuple((dr, dc, frozenset(pieces)) for (dr, dc), pieces in attacks.items())
+
+def buildSlideAttacks(color):
+    attacks = {d: set() for d in kingMoves}
+    for piece, directions in slideDirections.items():
+        for dr, dc in directions[color]:
+            attacks[(-dr, -dc)].add(piece)
+    return tuple((dr, dc, frozenset(pieces)) for (dr, dc), pieces in attacks.items())
+
+stepAttacks = (buildStepAttacks(0), buildStepAttacks(1))
+slideAttacks = (buildSlideAttacks(0), buildSlideAttacks(1))
+
+'''
+Per square lookup tables built once at import (about 15 ms), so move generation and attack tests only walk squares
+known to be on the board.
+Squares reached from (r, c) going dr, dc, one square for a step and up to the edge for a slide
+'''
+def raySquares(r, c, dr, dc, slide):
+    squares = []
+    r += dr
+    c += dc
+    while 0 <= r <= 8 and 0 <= c <= 8:
+        squares.append(r*9 + c)
+        if not slide:
+            break
+        r += dr
+        c += dc
+    return tuple(squares)
+
+'''
+pieceRays[color][piece][square] holds the rays a piece walks when it moves, a step being a ray of one square.
+Promoted Bishops step before they slide and promoted Rooks slide before they step, the order moves were always generated in
+'''
+def buildPieceRays(color):
+    rays = [None] * len(pieceLetters)
+    for piece in range(PAWN, len(pieceLetters)):
+        steps = [(dr, dc, False) for dr, dc in stepOffsets.get(piece, ((), ()))[color]]
+        slides = [(dr, dc, True) for dr, dc in slideDirections.get(piece, ((), ()))[color]]
+        walks = steps + slides if piece == PROM_BISHOP else slides + steps
+        rays[piece] = [tuple(ray for ray in (raySquares(r, c, dr, dc, slide) for dr, dc, slide in walks) if ray)
+                       for r in range(9) for c in range(9)]
+    return rays
+
+'''
+stepAttackSquares[color][square] holds (attacker square, pieces) for every step attack on the square and
+slideAttackRays[color][square] holds (squares, sliders, dr, dc) for every line a slider could attack it along
+'''
+def buildStepAttackSquares(color):
+    return [tuple((sq + dr*9 + dc, pieces) for dr, dc, pieces in stepAttacks[color] if 0 <= sq // 9 + dr <= 8 and 0 <= sq % 9 + dc <= 8)
+            for sq in range(81)]
+
+def buildSlideAttackRays(color):
+    return [tuple((raySquares(sq // 9, sq % 9, dr, dc, True), sliders, dr, dc) for dr, dc, sliders in slideAttacks[color]
+                  if raySquares(sq // 9, sq % 9, dr, dc, True))
+            for sq in range(81)]
+
+pieceRays = (buildPieceRays(0), buildPieceRays(1))
+stepAttackSquares = (buildStepAttackSquares(0), buildStepAttackSquares(1))
+slideAttackRays = (buildSlideAttackRays(0), buildSlideAttackRays(1))
+
+'''
+Zobrist keys: a random 64 bit number for every piece code on every square and one for black to move.
+The key of a position is the xor of the numbers of everything in it, so a move only changes a few of them.
+A fixed seed keeps keys the same in every process
+'''
+zobristRandom = random.Random(20230419)
+zobristPieces = [[0] * 81] + [[zobristRandom.getrandbits(64) for sq in range(81)] for code in range(len(pieceNames) - 1)]     #Indexed like pieceNames, empty squares add nothing
+zobristBlackToMove = zobristRandom.getrandbits(64)
+#Number for holding count pieces of a type, indexed by color (black 0, white 1), piece type and count. Holding none adds nothing
+zobristHands = [[[0] + [zobristRandom.getrandbits(64) for count in range(80)] for piece in range(KING)] for color in range(2)]
+
+'''
+Repetition (sennichite) of a position, see GameState.repetition.
+The game is over when a position occurs for the SENNICHITE_COUNT time: drawn, unless one player gave check on every
+move of the repetition, who then loses
+'''
+SENNICHITE_COUNT = 4
+NO_REPETITION = 0
+REPETITION = 1      #Position occurred before
+SENNICHITE = 2      #Position occurred SENNICHITE_COUNT times, a draw
+PERPETUAL_CHECK_WIN = 3     #Repeated while the opponent checked on every move, the player to move wins
+PERPETUAL_CHECK_LOSS = 4    #Repeated while the player to move checked on every move, the player to move loses
+
 
 class GameState():
-    def __init__(self):
+    __slots__ = ('squares', 'whiteToMove', 'moveLog', 'whiteKingLocation', 'blackKingLocation',
+                 'checkMate', 'staleMate', 'zobristKey', 'material', 'startMoveNumber', 'hands', 'pawnFiles',
+                 'keyHistory', 'keyCounts')
+
+    '''
+    Start position, or the given 9x9 board of two character piece names with the given player to move
+    '''
+    def __init__(self, board=None, whiteToMove=True):
 
         # 9x9 board
         # '--' is empty space, K->King, G->Gold general, S->Silver general, N->Knight, L->Lance, R->Rook, B->Bishop, p->Pawn
         # O->Promoted Rook, H->Promoted Bishop
-        self.board = [
+        startBoard = [
             ['bL', 'bN', 'bS', 'bG', 'bK', 'bG', 'bS', 'bN', 'bL'],
             ['--', 'bR', '--', '--', '--', '--', '--', 'bB', '--'],
             ['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
@@ -21,77 +243,409 @@ class GameState():
             ['--', 'wB', '--', '--', '--', '--', '--', 'wR', '--'],
             ['wL', 'wN', 'wS', 'wG', 'wK', 'wG', 'wS', 'wN', 'wL']]
 
-        self.whiteToMove = True
-        self.moveLog = []
+        if board is None:
+            board = startBoard
 
-        self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'B': self.getBishopMoves, 'L': self.getLanceMoves, 'N': self.getKnightMoves,
-                              'S': self.getSilvGenMoves, 'G': self.getGoldGenMoves, 'K': self.getKingMoves, 'O': self.getPromRookMoves, 'H': self.getPromBishopMoves }
+        #Flat board of 81 piece codes, square (r, c) is stored at index r*9 + c
+        self.setup([pieceCodes[piece] for row in board for piece in row], whiteToMove)
 
-        self.whiteKingLocation = (8,4)
-        self.blackKingLocation = (0,4)
+    '''
+    State of a new game from a flat board of piece codes, shared by the constructor and the position loaders.
+    hands holds the black and the white hand as lists of counts indexed by piece type, both empty when left out
+    '''
+    def setup(self, squares, whiteToMove, moveNumber=1, hands=None):
+        self.squares = squares
+        self.whiteToMove = whiteToMove
+        self.moveLog = []
+        self.startMoveNumber = moveNumber       #SFEN move number of the position before moveLog
+
+        if squares.count(KING) != 1 or squares.count(-KING) != 1:
+            raise ValueError('Each player needs exactly one king')
+        self.whiteKingLocation = divmod(squares.index(KING), 9)
+        self.blackKingLocation = divmod(squares.index(-KING), 9)
+
+        self.hands = [[0] * KING, [0] * KING] if hands is None else [list(hand) for hand in hands]
+        if any(not 0 <= count < len(zobristHands[0][0]) for hand in self.hands for count in hand):
+            raise ValueError('Not a number of pieces in hand')
+        #Bit c of pawnFiles[color] is set while the player has an unpromoted pawn in column c, kept up to date like zobristKey
+        self.pawnFiles = [0, 0]
+        for sq, piece in enumerate(squares):
+            if piece == PAWN or piece == -PAWN:
+                self.pawnFiles[piece > 0] |= fileBits[sq]
 
         self.checkMate = False
         self.staleMate = False
 
+        self.zobristKey = self.computeZobristKey()     #Kept up to date by makeMove and undoMove
+        self.material = self.computeMaterial()     #White material minus black material, kept up to date like zobristKey
+        #Key of the position after every move of moveLog, the first one before it, and how often each key is in there
+        self.keyHistory = [self.zobristKey]
+        self.keyCounts = {self.zobristKey: 1}
+
+    '''
+    Independent copy of the game with its move log, e.g. to search it in another thread while this one is drawn
+    '''
+    def copy(self):
+        gs = self.__class__.__new__(self.__class__)
+        for name in GameState.__slots__:
+            setattr(gs, name, getattr(self, name))
+        gs.squares = list(self.squares)
+        gs.moveLog = list(self.moveLog)
+        gs.hands = [list(hand) for hand in self.hands]
+        gs.pawnFiles = list(self.pawnFiles)
+        gs.keyHistory = list(self.keyHistory)
+        gs.keyCounts = dict(self.keyCounts)
+        return gs
+
+    '''
+    9x9 list of two character piece names derived from the flat board, used for drawing
+    '''
+    @property
+    def board(self):
+        squares = self.squares
+        return [[pieceNames[squares[r*9 + c]] for c in range(9)] for r in range(9)]
+
+    '''
+    Valid move written in USI notation such as 7g7f or the drop P*5e.
+    Promotions are forced, so a trailing + is optional
+    '''
+    def parseMove(self, notation):
+        notation = notation.rstrip('+')
+        for move in self.getValidMoves():
+            if move.getShogiNotation().rstrip('+') == notation:
+                return move
+        raise ValueError('Not a valid move: ' + notation)
+
+    '''
+    Zobrist key of the position computed from scratch
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                key ^= zobristPieces[piece][sq]
+        for color in range(2):
+            for piece, count in enumerate(self.hands[color]):
+                key ^= zobristHands[color][piece][count]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        return key
+
+    '''
+    Material balance computed from scratch, a piece in hand is worth the same as on the board
+    '''
+    def computeMaterial(self):
+        blackHand, whiteHand = self.hands
+        return sum([codeScores[piece] for piece in self.squares]) \
+               + sum([codeScores[piece] * (whiteHand[piece] - blackHand[piece]) for piece in handPieces])
+
+    '''
+    Position written as SFEN: board, player to move, pieces in hand and move number
+    '''
+    def toSfen(self):
+        squares = self.squares
+        rows = []
+        for r in range(9):
+            row = ''
+            empty = 0
+            for piece in squares[r*9:r*9 + 9]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += sfenPieces[piece]
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        hand = ''
+        for color in (1, 0):    #Sente (white) pieces first
+            for piece in handPieces:
+                count = self.hands[color][piece]
+                if count:
+                    hand += (str(count) if count > 1 else '') + sfenPieces[piece if color else -piece]
+        return '%s %s %s %d' % ('/'.join(rows), 'b' if self.whiteToMove else 'w', hand or '-',
+                                self.startMoveNumber + len(self.moveLog))
+
+    '''
+    Game state of a SFEN string, the move number may be left out.
+    Raises ValueError for anything that is not a position of this engine
+    '''
+    @classmethod
+    def fromSfen(cls, sfen):
+        fields = sfen.split()
+        if len(fields) not in (3, 4) or fields[1] not in ('b', 'w'):
+            raise ValueError('Not a SFEN position: ' + sfen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 9:
+            raise ValueError('SFEN board does not have 9 ranks: ' + fields[0])
+        squares = []
+        for rank in ranks:
+            rankStart = len(squares)
+            promoted = False
+            for char in rank:
+                if char == '+':
+                    promoted = True
+                    continue
+                run = (sfenPromotedRuns if promoted else sfenRuns).get(char)
+                if run is None:
+                    raise ValueError('Not a SFEN piece: ' + ('+' if promoted else '') + char)
+                squares += run
+                promoted = False
+            if len(squares) - rankStart != 9 or promoted:
+                raise ValueError('SFEN rank is not 9 squares long: ' + rank)
+        hands = [[0] * KING, [0] * KING]
+        if fields[2] != '-':
+            count = ''
+            for char in fields[2]:
+                if char.isdigit():
+                    count += char
+                    continue
+                piece = sfenRuns.get(char, [EMPTY])[0]
+                if abs(piece) not in handPieces:
+                    raise ValueError('Not a SFEN piece in hand: ' + char)
+                hands[piece > 0][abs(piece)] += int(count) if count else 1
+                count = ''
+            if count:
+                raise ValueError('SFEN hand ends in a count: ' + fields[2])
+        if len(fields) == 4 and not fields[3].isdigit():
+            raise ValueError('Not a SFEN move number: ' + fields[3])
+        moveNumber = int(fields[3]) if len(fields) == 4 else 1
+        gs = cls.__new__(cls)
+        gs.setup(squares, fields[1] == 'b', moveNumber, hands)
+        return gs
+
+    '''
+    Compact binary form of the position, about 40 bytes:
+    2 bytes with the player to move in the lowest bit and the move number above it,
+    11 bytes with one bit per occupied square, then 5 bits per piece in square order,
+    the type code for white pieces and 16 plus the type code for black pieces.
+    When a player holds pieces, one byte per piece in hand type follows, white then black in SFEN order.
+    All numbers are little endian. Raises ValueError past move number MAX_BYTES_MOVE_NUMBER
+    '''
+    def toBytes(self):
+        moveNumber = self.startMoveNumber + len(self.moveLog)
+        if moveNumber > MAX_BYTES_MOVE_NUMBER:
+            raise ValueError('Move number %d does not fit the binary form' % moveNumber)
+        occupancy = 0
+        pieces = 0
+        shift = 0
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                occupancy |= 1 << sq
+                pieces |= (piece if piece > 0 else 16 - piece) << shift
+                shift += 5
+        header = moveNumber << 1 | self.whiteToMove
+        data = header.to_bytes(2, 'little') + occupancy.to_bytes(11, 'little') + pieces.to_bytes((shift + 7) // 8, 'little')
+        if any(self.hands[0]) or any(self.hands[1]):
+            data += bytes(self.hands[color][piece] for color in (1, 0) for piece in handPieces)
+        return data
+
+    @classmethod
+    def fromBytes(cls, data):
+        header = int.from_bytes(data[:2], 'little')
+        occupancy = int.from_bytes(data[2:13], 'little')
+        piecesEnd = 13 + (bin(occupancy).count('1') * 5 + 7) // 8
+        pieces = int.from_bytes(data[13:piecesEnd], 'little')
+        squares = [EMPTY] * 81
+        for sq in range(81):
+            if occupancy >> sq & 1:
+                piece = pieces & 31
+                pieces >>= 5
+                squares[sq] = piece if piece < 16 else 16 - piece
+        hands = [[0] * KING, [0] * KING]
+        counts = data[piecesEnd:]
+        if counts:
+            if len(counts) != 2 * len(handPieces):
+                raise ValueError('Not a position: %d bytes of pieces in hand' % len(counts))
+            for i, piece in enumerate(handPieces):
+                hands[1][piece] = counts[i]
+                hands[0][piece] = counts[len(handPieces) + i]
+        gs = cls.__new__(cls)
+        gs.setup(squares, bool(header & 1), header >> 1, hands)
+        return gs
+
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        squares = self.squares
+        start = move.start
+        end = move.end
+        moved = move.pieceMovedCode
         self.moveLog.append(move)   #To save the moves so that we can undo later
         self.whiteToMove = not self.whiteToMove     #swap players
 
-        #Update kings location if moved
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        if move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
-
-        #Promotion to Gold General
-        if move.isPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'G'
-
-        #Rook promotion
-        if move.isRookPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'O'
+        if start >= DROP:   #Piece leaves the hand for the end square, the material stays the same
+            piece = start - DROP
+            color = moved > 0
+            hand = self.hands[color]
+            count = hand[piece]
+            hand[piece] = count - 1
+            squares[end] = moved
+            if piece == PAWN:
+                self.pawnFiles[color] |= fileBits[end]
+            self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count - 1] \
+                               ^ zobristPieces[moved][end] ^ zobristBlackToMove
+            self.recordPosition()
+            return
+
+        captured = move.pieceCapturedCode
+        arrived = move.promotedCode or moved    #Promoted piece arrives in place of the moved one
+        squares[start] = EMPTY
+        squares[end] = arrived
 
-        #Bishop promotion
-        if move.isBishopPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'H'
+        #Update kings location if moved
+        if moved == KING:
+            self.whiteKingLocation = divmod(end, 9)
+        if moved == -KING:
+            self.blackKingLocation = divmod(end, 9)
+
+        #Update position key: piece leaves its start square, captured piece leaves and the (promoted) piece arrives at the end square
+        self.zobristKey ^= zobristPieces[moved][start] ^ zobristPieces[captured][end] ^ zobristPieces[arrived][end] ^ zobristBlackToMove
+        #Captured piece leaves the balance and a promotion adds its gain
+        self.material += codeScores[arrived] - codeScores[moved] - codeScores[captured]
+        if move.promotedCode and (moved == PAWN or moved == -PAWN):
+            self.pawnFiles[moved > 0] &= ~fileBits[start]
+        if captured:    #Captured piece goes unpromoted into the hand of the mover
+            color = moved > 0
+            piece = handTypes[captured]
+            hand = self.hands[color]
+            count = hand[piece]
+            hand[piece] = count + 1
+            self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count + 1]
+            self.material += codeScores[piece] if color else -codeScores[piece]
+            if captured == PAWN or captured == -PAWN:
+                self.pawnFiles[not color] &= ~fileBits[end]
+        self.recordPosition()
 
 
+    '''
+    Pass the turn, for null-move pruning in the search. Not a legal shogi move, undoMove takes it back.
+    The counts of the positions before it are set aside meanwhile, so no line with a pass in it repeats a position played before it
+    '''
+    def makeNullMove(self):
+        self.moveLog.append(NullMove(self.keyCounts))
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= zobristBlackToMove
+        self.keyCounts = {}
+        self.recordPosition()
 
     #Undo the last move
     def undoMove(self):
         #Pop the last move and execute the move previous to it
         if len(self.moveLog) != 0:
-            #print(self.moveLog)
+            self.forgetPosition()
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            squares = self.squares
+            start = move.start
+            end = move.end
+            moved = move.pieceMovedCode
             self.whiteToMove = not self.whiteToMove     #switch turns back
-            #Update king's location
-            if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            if move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
+
+            if start == NULL:   #Passed turn, the positions before it count again
+                self.zobristKey ^= zobristBlackToMove
+                self.keyCounts = move.keyCounts
+            elif start >= DROP:   #Dropped piece goes back to the hand
+                piece = start - DROP
+                color = moved > 0
+                hand = self.hands[color]
+                count = hand[piece]
+                hand[piece] = count + 1
+                squares[end] = EMPTY
+                if piece == PAWN:
+                    self.pawnFiles[color] &= ~fileBits[end]
+                self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count + 1] \
+                                   ^ zobristPieces[moved][end] ^ zobristBlackToMove
+            else:
+                captured = move.pieceCapturedCode
+                arrived = squares[end]
+                self.zobristKey ^= zobristPieces[moved][start] ^ zobristPieces[captured][end] ^ zobristPieces[arrived][end] ^ zobristBlackToMove
+                self.material -= codeScores[arrived] - codeScores[moved] - codeScores[captured]
+                squares[start] = moved
+                squares[end] = captured
+                #Update king's location
+                if moved == KING:
+                    self.whiteKingLocation = divmod(start, 9)
+                if moved == -KING:
+                    self.blackKingLocation = divmod(start, 9)
+                if move.promotedCode and (moved == PAWN or moved == -PAWN):
+                    self.pawnFiles[moved > 0] |= fileBits[start]
+                if captured:    #Captured piece leaves the hand of the mover
+                    color = moved > 0
+                    piece = handTypes[captured]
+                    hand = self.hands[color]
+                    count = hand[piece]
+                    hand[piece] = count - 1
+                    self.zobristKey ^= zobristHands[color][piece][count] ^ zobristHands[color][piece][count - 1]
+                    self.material -= codeScores[piece] if color else -codeScores[piece]
+                    if captured == PAWN or captured == -PAWN:
+                        self.pawnFiles[not color] |= fileBits[end]
 
         self.checkMate = False
         self.staleMate = False
 
     '''
-        All moves considering checks
-        '''
+    All moves considering checks.
+    Pins and checks on the king are found once, so no move has to be made and undone to test it.
+    The candidates are packed ints, a Move is only built for the ones that are valid
+    '''
     def getValidMoves(self):
         moves = self.getAllPossibleMoves()
-        for i in range(len(moves)-1, -1, -1):   #Traverse from back so that no moves are missed
-            self.makeMove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
-                moves.remove(moves[i])      #Remove invalid move from available moves list
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        pins, checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        squares = self.squares
+        sign = 1 if self.whiteToMove else -1
+
+        #Squares a non king move has to end on to stop the check
+        validSquares = None
+        if len(checks) == 1:
+            checkRow, checkCol, dr, dc = checks[0]
+            validSquares = set()
+            endRow = kingRow + dr
+            endCol = kingCol + dc
+            while (endRow, endCol) != (checkRow, checkCol):     #Blocking squares of a sliding check
+                validSquares.add(endRow*9 + endCol)
+                endRow += dr
+                endCol += dc
+            validSquares.add(checkRow*9 + checkCol)
+
+        kingSquare = kingRow*9 + kingCol
+        #The one pawn drop that checks the enemy king, illegal when it mates
+        enemyKing = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
+        checkSquare = (enemyKing[0] + sign)*9 + enemyKing[1]
+        pawnCheckDrop = (DROP + PAWN) << 7 | checkSquare if 0 <= checkSquare < 81 else -1
+        validMoves = []
+        for packed in moves:
+            start = packed >> 7
+            end = packed & 127
+            if start == kingSquare:
+                #King can not step onto an attacked square, it is lifted so that it does not hide squares behind it
+                squares[kingSquare] = EMPTY
+                attacked = self.isAttacked(end, -sign)
+                squares[kingSquare] = KING * sign
+                if attacked:
+                    continue
+            else:
+                if len(checks) > 1:     #Only the king can escape a double check
+                    continue
+                if validSquares is not None and end not in validSquares:
+                    continue
+                pin = pins.get(start)
+                if pin is not None and (end // 9 - kingRow) * pin[1] != (end % 9 - kingCol) * pin[0]:    #Moves off the pin line
+                    continue
+                if start >= DROP:
+                    move = Move.drop((start - DROP) * sign, end)
+                    if packed == pawnCheckDrop and self.isPawnDropMate(move):
+                        continue
+                    validMoves.append(move)
+                    continue
+            validMoves.append(Move(start, end, squares))
+        moves = validMoves
 
         if len(moves) == 0:     #No valid moves available
-            if self.inCheck():
+            if len(checks) > 0:
                 self.checkMate = True
             else:
                 self.staleMate = True
@@ -102,341 +656,287 @@ class GameState():
 
         return moves
 
-
     '''
-    If the current player is in check position 
+    Pieces pinned to the king and pieces giving check, found by walking rays out from the king.
+    Returns pins as {square: (dr, dc)} and checks as [(row, col, dr, dc)], with (dr, dc) pointing from the king to the checker
     '''
-    def inCheck(self):
-        if self.whiteToMove:
-            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
-        else:
-            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
+    def checkForPinsAndChecks(self, kingRow, kingCol):
+        pins = {}
+        checks = []
+        squares = self.squares
+        sign = 1 if self.whiteToMove else -1
+        enemyColor = 0 if self.whiteToMove else 1
+
+        kingSquare = kingRow*9 + kingCol
+
+        for ray, sliders, dr, dc in slideAttackRays[enemyColor][kingSquare]:
+            possiblePin = None
+            for end in ray:
+                endPiece = squares[end] * sign
+                if endPiece > 0:    #Users piece
+                    if possiblePin is not None:
+                        break   #Second users piece, no pin along this direction
+                    possiblePin = end
+                elif endPiece < 0:  #Enemy piece
+                    if -endPiece in sliders:
+                        if possiblePin is None:
+                            checks.append((end // 9, end % 9, dr, dc))
+                        else:
+                            pins[possiblePin] = (dr, dc)
+                    break
 
+        for end, pieces in stepAttackSquares[enemyColor][kingSquare]:
+            endPiece = -squares[end] * sign
+            if endPiece > 0 and endPiece in pieces:
+                endRow, endCol = divmod(end, 9)
+                if not any(check[0] == endRow and check[1] == endCol for check in checks):  #Not found by a ray already
+                    checks.append((endRow, endCol, endRow - kingRow, endCol - kingCol))
 
-    def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        return False
+        return pins, checks
 
     '''
-    All moves without considering checks
+    If dropping the pawn checkmates, which the rules forbid (uchifuzume).
+    The enemy king takes a pawn nothing defends, so only a defended pawn needs the drop to be made and the replies counted
     '''
-    def getAllPossibleMoves(self):
-        moves = []
-        for r in range(len(self.board)):    #Rows
-            for c in range(len(self.board[r])):     #Columns
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
-
-        return moves
-
-
-    def getPawnMoves(self, r, c, moves):
-        if self.whiteToMove:    #White pawn moves
-            if self.board[r-1][c] == '--':
-                moves.append(Move((r, c), (r-1, c), self.board))
-            if self.board[r-1][c][0] == 'b':
-                moves.append(Move((r, c), (r-1, c), self.board))
-
-        else:    #Black pawn moves
-            if self.board[r+1][c] == '--':
-                moves.append(Move((r, c), (r+1, c), self.board))
-            if self.board[r+1][c][0] == 'w':
-                moves.append(Move((r, c), (r+1, c), self.board))
-
+    def isPawnDropMate(self, move):
+        if not self.isAttacked(move.end, move.pieceMovedCode):
+            return False
+        self.makeMove(move)
+        mate = not self.getValidMoves()
+        self.undoMove()
+        return mate
 
-    def getRookMoves(self, r, c, moves):
-        directions = ((-1,0), (0,-1), (1,0), (0,1))     #Up, left, down, right
-        if self.whiteToMove:
-            enemy_color = 'b'
-        else:
-            enemy_color = 'w'
-        for d in directions:
-            for i in range(1,9):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':    #Blank space
-                        moves.append(Move((r,c), (endRow,endCol), self.board))
-                    elif endPiece[0] == enemy_color:   #Enemy piece
-                        moves.append(Move((r,c), (endRow,endCol), self.board))
-                        break
-                    else:
-                        break   #Users piece
-                else:
-                    break   #Moves outside the board
-
-
-    def getPromRookMoves(self, r, c, moves):
-        directions = ((-1,0), (0,-1), (1,0), (0,1))     #Up, left, down, right
-        if self.whiteToMove:
-            enemy_color = 'b'
-        else:
-            enemy_color = 'w'
-        for d in directions:
-            for i in range(1,9):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':    #Blank space
-                        moves.append(Move((r,c), (endRow,endCol), self.board))
-                    elif endPiece[0] == enemy_color:   #Enemy piece
-                        moves.append(Move((r,c), (endRow,endCol), self.board))
-                        break
-                    else:
-                        break   #Users piece
-                else:
-                    break   #Move outside the board
-
-        if self.whiteToMove:
-            userColor = 'w'
-            promRookMoves = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-            for i in range(4):
-                endRow = r + promRookMoves[i][0]
-                endCol = c + promRookMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
 
+    '''
+    Key history kept by makeMove and undoMove
+    '''
+    def recordPosition(self):
+        key = self.zobristKey
+        self.keyHistory.append(key)
+        self.keyCounts[key] = self.keyCounts.get(key, 0) + 1
+
+    def forgetPosition(self):
+        key = self.keyHistory.pop()
+        count = self.keyCounts[key]
+        if count == 1:
+            del self.keyCounts[key]     #Positions of a search do not pile up
         else:
-            userColor = 'b'
-            promRookMoves = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-            for i in range(4):
-                endRow = r + promRookMoves[i][0]
-                endCol = c + promRookMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
+            self.keyCounts[key] = count - 1
 
+    '''
+    How often the current position occurred since the game was set up, this one included
+    '''
+    def repetitionCount(self):
+        return self.keyCounts[self.zobristKey]
 
+    '''
+    Repetition state of the current position: NO_REPETITION, REPETITION, SENNICHITE or a perpetual check.
+    Any move can be undone in shogi, as captured pieces are dropped back, so there is no last irreversible move to stop at.
+    Instead nothing is scanned unless the count says the position occurred before, and the scan stops at that occurrence:
+    the cycle is then taken back to see whether one player checked on every move of it
+    '''
+    def repetition(self):
+        count = self.keyCounts[self.zobristKey]
+        if count < 2:
+            return NO_REPETITION
+        history = self.keyHistory
+        cycle = 2       #Same player to move, same key
+        while history[-1 - cycle] != self.zobristKey:
+            cycle += 2
+        checkMate, staleMate = self.checkMate, self.staleMate
+        moves = self.moveLog[-cycle:]
+        checks = []     #If the player to move is in check in every position of the cycle, going back
+        for move in moves:
+            self.undoMove()
+            checks.append(self.inCheck())
+        for move in moves:
+            self.makeMove(move)
+        self.checkMate, self.staleMate = checkMate, staleMate
+        if all(checks[1::2]):   #The player to move now was in check after every move of the opponent
+            return PERPETUAL_CHECK_WIN
+        if all(checks[0::2]):
+            return PERPETUAL_CHECK_LOSS
+        return SENNICHITE if count >= SENNICHITE_COUNT else REPETITION
 
-    def getBishopMoves(self, r, c, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # Four corners
+    '''
+    If the current player is in check position
+    '''
+    def inCheck(self):
         if self.whiteToMove:
-            enemy_color = 'b'
+            return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
         else:
-            enemy_color = 'w'
-        for d in directions:
-            for i in range(1, 9):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':  # Blank space
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemy_color:  # Enemy piece
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:
-                        break  # Users piece
-                else:
-                    break  # Move outside the board
+            return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
 
-    def getPromBishopMoves(self, r, c, moves):
-        if self.whiteToMove:
-            userColor = 'w'
-            promBishopMoves = ((-1, 0), (1, 0), (0, -1), (0, 1))
-            for i in range(4):
-                endRow = r + promBishopMoves[i][0]
-                endCol = c + promBishopMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+    def squareUnderAttack(self, r, c):
+        sign = 1 if self.whiteToMove else -1
+        if self.squares[r*9 + c] * sign < 0:    #Opponent can not move onto its own piece
+            return False
+        return self.isAttacked(r*9 + c, -sign)
 
-        else:
-            userColor = 'b'
-            promBishopMoves = ((-1, 0), (1, 0), (0, -1), (0, 1))
-            for i in range(4):
-                endRow = r + promBishopMoves[i][0]
-                endCol = c + promBishopMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-        ####
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # Diagonals
-        if self.whiteToMove:
-            enemy_color = 'b'
-        else:
-            enemy_color = 'w'
-        for d in directions:
-            for i in range(1, 9):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':  # Blank space
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemy_color:  # Enemy piece
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:
-                        break  # Users piece
-                else:
-                    break  # Move outside the board
+    '''
+    If any piece of the given color (1 for white, -1 for black) attacks the square
+    '''
+    def isAttacked(self, sq, color):
+        squares = self.squares
+        table = 1 if color > 0 else 0
+        for start, pieces in stepAttackSquares[table][sq]:
+            piece = squares[start] * color
+            if piece > 0 and piece in pieces:
+                return True
 
-    def getLanceMoves(self, r, c, moves):
-        if self.whiteToMove:
-            enemyColor = 'b'
-            for i in range(1, 9):
-                endRow = r + (-1) * i
-                endCol = c
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':  # Blank space
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:  # Enemy piece
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:
-                        break  # Users piece
-                else:
+        for ray, sliders, dr, dc in slideAttackRays[table][sq]:
+            for start in ray:
+                piece = squares[start] * color
+                if piece != EMPTY:
+                    if piece > 0 and piece in sliders:
+                        return True
                     break
+        return False
 
-        else:
-            enemyColor = 'w'
-            for i in range(1, 9):
-                endRow = r + 1 * i
-                endCol = c
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':  # Blank space
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:  # Enemy piece
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
+    '''
+    All moves without considering checks, packed as start square << 7 | end square.
+    Every piece walks its rays from pieceRays and stops at the first piece, which it captures if it is an enemy.
+    Drops of the pieces in hand follow, on the empty squares of their drop range and for pawns only on files without one
+    '''
+    def getAllPossibleMoves(self):
+        moves = []
+        squares = self.squares
+        sign = 1 if self.whiteToMove else -1
+        rays = pieceRays[self.whiteToMove]
+        for start in range(81):
+            piece = squares[start] * sign   #Positive only for the pieces of the player to move
+            if piece > 0:
+                packedStart = start << 7
+                for ray in rays[piece][start]:
+                    for end in ray:
+                        endPiece = squares[end] * sign
+                        if endPiece <= 0:   #Blank space or enemy piece
+                            moves.append(packedStart | end)
+                        if endPiece != EMPTY:
+                            break
+
+        color = self.whiteToMove
+        hand = self.hands[color]
+        if any(hand):
+            empties = [sq for sq, piece in enumerate(squares) if not piece]
+            for piece in handPieces:
+                if hand[piece]:
+                    packedStart = (DROP + piece) << 7
+                    first, last = dropRanges[color][piece]
+                    if piece == PAWN:
+                        files = self.pawnFiles[color]
+                        moves += [packedStart | sq for sq in empties if first <= sq < last and not files & fileBits[sq]]
                     else:
-                        break  # Users piece
-                else:
-                    break
+                        moves += [packedStart | sq for sq in empties if first <= sq < last]
 
-    def getKnightMoves(self, r, c, moves):
-        if self.whiteToMove:
-            knightMoves = ((-2,-1), (-2,1))
-            userColor = 'w'
-            for m in knightMoves:
-                endRow = r + m[0]
-                endCol = c + m[1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r,c), (endRow,endCol), self.board))
-        else:
-            knightMoves = ((2, -1), (2, 1))
-            userColor = 'b'
-            for m in knightMoves:
-                endRow = r + m[0]
-                endCol = c + m[1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-
-    def getSilvGenMoves(self, r, c, moves):
-        if self.whiteToMove:
-            userColor = 'w'
-            silvGenMoves = ((-1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1))
-            for i in range(5):
-                endRow = r + silvGenMoves[i][0]
-                endCol = c + silvGenMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-        else:
-            userColor = 'b'
-            silvGenMoves = ((1, 0), (1, -1), (1, 1), (-1, -1), (-1, 1))
-            for i in range(5):
-                endRow = r + silvGenMoves[i][0]
-                endCol = c + silvGenMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-    def getGoldGenMoves(self, r, c, moves):
-        if self.whiteToMove:
-            userColor = 'w'
-            goldGenMoves = ((-1, 0), (-1, -1), (-1, 1), (0, -1), (0, 1),(1,0))
-            for i in range(6):
-                endRow = r + goldGenMoves[i][0]
-                endCol = c + goldGenMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-        else:
-            userColor = 'b'
-            silvGenMoves = ((1, 0), (1, -1), (1, 1), (0, -1), (0, 1), (-1,0))
-            for i in range(6):
-                endRow = r + silvGenMoves[i][0]
-                endCol = c + silvGenMoves[i][1]
-                if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != userColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-    def getKingMoves(self, r, c, moves):
-        kingMoves = ((-1,0),(1,0),(-1,1),(1,1),(0,1),(-1,-1),(0,-1),(1,-1))
-        if  self.whiteToMove:
-            userColor = 'w'
-        else:
-            userColor = 'b'
-        for i in range(8):
-            endRow = r + kingMoves[i][0]
-            endCol = c + kingMoves[i][1]
-            if 0 <= endRow <= 8 and 0 <= endCol <= 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != userColor:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        return moves
 
+'''
+A move from one square of the flat board to another.
+Only what making and ordering the move needs is stored, rows, columns and promotion flags are derived when asked for.
+moveId is the move packed as start << 7 | end, the form the move generators work with.
+A drop has DROP plus the piece type as its start
+'''
 class Move():
+    __slots__ = ('start', 'end', 'pieceMovedCode', 'pieceCapturedCode', 'promotedCode', 'moveId')
 
+    def __init__(self, start, end, squares):
+        self.start = start
+        self.end = end
+        self.pieceMovedCode = pieceMoved = squares[start]
+        self.pieceCapturedCode = squares[end]
+        self.promotedCode = promotionCodes[pieceMoved][end]     #Promotions are forced, 0 for moves that do not promote
+        self.moveId = start << 7 | end
 
-    def __init__(self, startSq, endSq, board):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPromotion = False
-        self.isRookPromotion = False
-        self.isBishopPromotion = False
-        if ((self.pieceMoved == 'wp' or self.pieceMoved == 'wS' or self.pieceMoved == 'wL' or self.pieceMoved == 'wN') and self.endRow <= 2 and self.endRow >=0) \
-                or ((self.pieceMoved == 'bp' or self.pieceMoved == 'bS' or self.pieceMoved == 'bL' or self.pieceMoved == 'bN') and self.endRow <= 8 and self.endRow >=6):
-            self.isPromotion = True
-
-        if (self.pieceMoved == 'wR'  and self.endRow <= 2 and self.endRow >=0) \
-                or (self.pieceMoved == 'bR'  and self.endRow <= 8 and self.endRow >=6):
-            self.isRookPromotion = True
+    @classmethod
+    def fromRowCol(cls, startSq, endSq, squares):
+        return cls(startSq[0]*9 + startSq[1], endSq[0]*9 + endSq[1], squares)
 
-        if (self.pieceMoved == 'wB'  and self.endRow <= 2 and self.endRow >=0) \
-                or (self.pieceMoved == 'bB'  and self.endRow <= 8 and self.endRow >=6):
-            self.isBishopPromotion = True
+    '''
+    Drop of a piece from the hand, piece is the code of the piece as it lands
+    '''
+    @classmethod
+    def drop(cls, piece, end):
+        move = cls.__new__(cls)
+        move.start = DROP + abs(piece)
+        move.end = end
+        move.pieceMovedCode = piece
+        move.pieceCapturedCode = EMPTY
+        move.promotedCode = 0
+        move.moveId = move.start << 7 | end
+        return move
+
+    @property
+    def isDrop(self):
+        return self.start >= DROP
+
+    @property
+    def startRow(self):
+        return self.start // 9
+
+    @property
+    def startCol(self):
+        return self.start % 9
+
+    @property
+    def endRow(self):
+        return self.end // 9
+
+    @property
+    def endCol(self):
+        return self.end % 9
+
+    @property
+    def isPromotion(self):      #Promotion to a piece moving like a Gold General
+        return self.promotedCode != 0 and abs(self.pieceMovedCode) in minorPromotions
+
+    @property
+    def isRookPromotion(self):
+        return abs(self.pieceMovedCode) == ROOK and self.promotedCode != 0
+
+    @property
+    def isBishopPromotion(self):
+        return abs(self.pieceMovedCode) == BISHOP and self.promotedCode != 0
+
+    @property
+    def pieceMoved(self):
+        return pieceNames[self.pieceMovedCode]
+
+    @property
+    def pieceCaptured(self):
+        return pieceNames[self.pieceCapturedCode]
 
-        self.moveId = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
 
+    '''
+    Move in USI notation: file and rank of the start and end squares, with + for a promotion. e.g. 7g7f, 8h2b+
+    A drop is the piece letter, * and the end square. e.g. P*5e
+    '''
+    def getShogiNotation(self):
+        endRow, endCol = divmod(self.end, 9)
+        if self.start >= DROP:
+            return sfenLetters[self.start - DROP] + '*' + str(9 - endCol) + chr(ord('a') + endRow)
+        startRow, startCol = divmod(self.start, 9)
+        notation = str(9 - startCol) + chr(ord('a') + startRow) + str(9 - endCol) + chr(ord('a') + endRow)
+        if self.promotedCode:
+            notation += '+'
+        return notation
 
     def __eq__(self, other):        #Compares object to other object
         if isinstance(other, Move):     #To make sure that this move is the instance of the move class and not make a move if not equal
             return self.moveId == other.moveId
         return False
 
+
+'''
+Pass of the turn on the move log, made by GameState.makeNullMove.
+Keeps the position counts that were set aside until it is undone
+'''
+class NullMove():
+    __slots__ = ('keyCounts',)
+    start = NULL
+    end = 0
+    pieceMovedCode = EMPTY
+
+    def __init__(self, keyCounts):
+        self.keyCounts = keyCounts
@@ -0,0 +1,68 @@
+'''
+Fixed size table of search results keyed by the Zobrist key of a position.
+Every bucket has two slots: one kept for the deepest search seen and one always replaced
+'''
+
+#Bound types of stored scores
+EXACT = 0
+LOWER_BOUND = 1     #Search failed high, the real score is at least the stored one
+UPPER_BOUND = 2     #Search failed low, the real score is at most the stored one
+
+ENTRY_BYTES = 120   #Rough memory of one stored entry (tuple of key, depth, score, bound and move id) in CPython
+DEFAULT_SIZE_MB = 16
+
+
+class TranspositionTable():
+    __slots__ = ('slots', 'mask', 'probes', 'hits', 'stores')
+
+    def __init__(self, sizeMb=DEFAULT_SIZE_MB):
+        buckets = 1
+        while 2 * buckets * 2 * ENTRY_BYTES <= sizeMb * 1024 * 1024:     #Largest power of two number of buckets whose two slots still fit the budget
+            buckets *= 2
+        self.mask = buckets - 1
+        self.slots = [None] * (2 * buckets)     #Slot 2i is depth preferred, slot 2i+1 is always replaced
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    '''
+    Stored (key, depth, score, bound, moveId) of a position or None
+    '''
+    def probe(self, key):
+        self.probes += 1
+        i = (key & self.mask) << 1
+        entry = self.slots[i]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        entry = self.slots[i + 1]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, moveId):
+        self.stores += 1
+        i = (key & self.mask) << 1
+        deepest = self.slots[i]
+        if deepest is None or deepest[0] == key or depth >= deepest[1]:
+            self.slots[i] = (key, depth, score, bound, moveId)
+        else:
+            self.slots[i + 1] = (key, depth, score, bound, moveId)
+
+    def hitRate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    '''
+    Fraction of slots in use, to see if the table is too small
+    '''
+    def usage(self):
+        return sum(1 for entry in self.slots if entry is not None) / len(self.slots)
@@ -0,0 +1,246 @@
+'''
+USI (Universal Shogi Interface) server on stdin/stdout, so Shogi GUIs and tournament managers can drive the engine.
+python UsiServer.py
+
+The search runs on a worker thread, so stop and ponderhit are read while it thinks.
+USI calls the player who moves first black (sente), which is the white player of GameState
+'''
+import sys
+import threading
+import time
+import ShogiEngine
+import AIMoveFinder
+
+ENGINE_NAME = 'ShogiEngine'
+ENGINE_AUTHOR = 'Shogi contributors'
+MOVE_OVERHEAD_MS = 50   #Kept back from every time limit for process and pipe delays
+MOVES_TO_GO = 30    #Share of the remaining time given to one move
+#Check options that switch parts of the search, by USI name
+SEARCH_OPTIONS = {'PVS': 'pvs', 'NullMove': 'nullMove', 'LateMoveReductions': 'lateMoveReductions'}
+
+
+'''
+Time for one move from the remaining time, the increment and the byoyomi of the player to move, all in milliseconds
+'''
+def allocateTime(remaining, increment, byoyomi):
+    limit = remaining // MOVES_TO_GO + increment + byoyomi - MOVE_OVERHEAD_MS
+    return max(1, min(limit, remaining + byoyomi - MOVE_OVERHEAD_MS))
+
+
+def formatScore(score):
+    if score >= AIMoveFinder.checkMate:
+        return 'mate +'
+    if score <= -AIMoveFinder.checkMate:
+        return 'mate -'
+    return 'cp %d' % (score * 100)      #Scores are counted in pawns
+
+
+class UsiServer():
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = ShogiEngine.GameState()
+        self.searcher = None
+        self.worker = None
+        self.pondering = False
+        self.ponderLimitMs = None   #Time limit to start once the ponder move is played
+        self.waitForStop = None     #Set when bestmove may be sent after an infinite or ponder search has finished
+        self.hashSizeMb = 16
+        self.searchOptions = {option: True for option in SEARCH_OPTIONS.values()}
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def run(self, input=sys.stdin):
+        for line in input:
+            if not self.handle(line):
+                break
+        self.stopSearch()
+
+    '''
+    Carry out one command, returns False on quit
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == 'usi':
+            self.send('id name ' + ENGINE_NAME)
+            self.send('id author ' + ENGINE_AUTHOR)
+            self.send('option name USI_Hash type spin default %d min 1 max 4096' % self.hashSizeMb)
+            self.send('option name USI_Ponder type check default true')
+            self.send('option name BookFile type string default <empty>')
+            for name in SEARCH_OPTIONS:
+                self.send('option name %s type check default true' % name)
+            self.send('usiok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            self.setOption(tokens[1:])
+        elif command == 'usinewgame':
+            self.stopSearch()
+            AIMoveFinder.transpositionTable.clear()
+        elif command == 'position':
+            self.stopSearch()
+            self.setPosition(tokens[1:])
+        elif command == 'go':
+            self.stopSearch()
+            self.go(tokens[1:])
+        elif command == 'stop':
+            self.stopSearch()
+        elif command == 'ponderhit':
+            self.ponderHit()
+        elif command == 'gameover':
+            self.stopSearch()
+        elif command == 'quit':
+            return False
+        else:
+            self.send('info string unknown command ' + command)
+        return True
+
+    def setOption(self, tokens):
+        if 'name' not in tokens:
+            return
+        valueAt = tokens.index('value') if 'value' in tokens else len(tokens)
+        name = ' '.join(tokens[tokens.index('name') + 1:valueAt])
+        value = ' '.join(tokens[valueAt + 1:])
+        if name == 'USI_Hash' and value.isdigit():
+            self.hashSizeMb = int(value)
+            AIMoveFinder.setHashSize(self.hashSizeMb)
+        elif name in SEARCH_OPTIONS and value in ('true', 'false'):
+            self.searchOptions[SEARCH_OPTIONS[name]] = value == 'true'
+        elif name == 'BookFile':
+            try:
+                AIMoveFinder.setOpeningBook(value if value and value != '<empty>' else None)
+            except (OSError, ValueError) as e:
+                AIMoveFinder.setOpeningBook(None)
+                self.send('info string ' + str(e))
+
+    '''
+    position startpos [moves ...] or position sfen <board> <side> <hand> <move number> [moves ...]
+    '''
+    def setPosition(self, tokens):
+        if not tokens:
+            return
+        try:
+            if tokens[0] == 'startpos':
+                gs = ShogiEngine.GameState()
+                rest = tokens[1:]
+            elif tokens[0] == 'sfen':
+                movesAt = tokens.index('moves') if 'moves' in tokens else len(tokens)
+                gs = ShogiEngine.GameState.fromSfen(' '.join(tokens[1:movesAt]))
+                rest = tokens[movesAt:]
+            else:
+                self.send('info string unknown position ' + tokens[0])
+                return
+        except ValueError as e:
+            self.send('info string ' + str(e))
+            return
+        if rest and rest[0] == 'moves':
+            for notation in rest[1:]:
+                try:
+                    gs.makeMove(gs.parseMove(notation))
+                except ValueError as e:
+                    self.send('info string ' + str(e))
+                    return
+        self.gs = gs
+
+    '''
+    go [ponder] [btime t] [wtime t] [binc t] [winc t] [byoyomi t] [movetime t] [depth d] [nodes n] [infinite]
+    '''
+    def go(self, tokens):
+        limits = {}
+        ponder = infinite = False
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == 'ponder':
+                ponder = True
+            elif tokens[i] == 'infinite':
+                infinite = True
+            elif i + 1 < len(tokens) and tokens[i + 1].lstrip('-').isdigit():
+                limits[tokens[i]] = int(tokens[i + 1])
+                i += 1
+            i += 1
+
+        #btime and binc belong to the player who moves first, which is white in GameState
+        remaining = limits.get('btime' if self.gs.whiteToMove else 'wtime')
+        increment = limits.get('binc' if self.gs.whiteToMove else 'winc', 0)
+        byoyomi = limits.get('byoyomi', 0)
+        if 'movetime' in limits:
+            timeLimitMs = max(1, limits['movetime'] - MOVE_OVERHEAD_MS)
+        elif remaining is not None:
+            timeLimitMs = allocateTime(remaining, increment, byoyomi)
+        elif byoyomi:
+            timeLimitMs = max(1, byoyomi - MOVE_OVERHEAD_MS)
+        else:
+            timeLimitMs = None
+
+        self.pondering = ponder
+        self.ponderLimitMs = timeLimitMs
+        if ponder or infinite:
+            timeLimitMs = None      #Searches until stop or ponderhit
+        if 'depth' in limits:
+            maxDepth = limits['depth']
+        elif timeLimitMs is None and 'nodes' not in limits and not (ponder or infinite):
+            maxDepth = AIMoveFinder.DEPTH   #Plain go without any limit
+        else:
+            maxDepth = AIMoveFinder.MAX_DEPTH
+        self.waitForStop = threading.Event() if ponder or infinite else None
+        self.searcher = AIMoveFinder.Searcher(self.gs, timeLimitMs, maxDepth, nodeLimit=limits.get('nodes'), infoCallback=self.sendInfo,
+                                              **self.searchOptions)
+        self.worker = threading.Thread(target=self.think, args=(self.searcher, self.waitForStop), daemon=True)
+        self.worker.start()
+
+    def think(self, searcher, waitForStop):
+        result = AIMoveFinder.bookMove(searcher.gs)
+        if result is None:
+            result = searcher.search()
+        if waitForStop is not None:
+            waitForStop.wait()      #USI forbids bestmove during ponder and infinite searches until stop or ponderhit
+        if result.bestMove is None:
+            self.send('bestmove resign')
+        elif len(result.pv) > 1:
+            self.send('bestmove %s ponder %s' % (result.bestMove.getShogiNotation(), result.pv[1].getShogiNotation()))
+        else:
+            self.send('bestmove ' + result.bestMove.getShogiNotation())
+
+    def sendInfo(self, result):
+        self.send('info depth %d score %s nodes %d nps %d time %d pv %s' % (result.depth, formatScore(result.score), result.nodes,
+                                                                            result.nodesPerSecond(), result.timeMs,
+                                                                            ' '.join(move.getShogiNotation() for move in result.pv)))
+
+    '''
+    The opponent played the ponder move, so the running search goes on as a normal timed search
+    '''
+    def ponderHit(self):
+        if self.searcher is None or not self.pondering:
+            return
+        self.pondering = False
+        if self.ponderLimitMs is not None:
+            self.searcher.deadline = time.perf_counter() + self.ponderLimitMs / 1000
+        else:
+            self.searcher.stop()
+        if self.waitForStop is not None:
+            self.waitForStop.set()
+
+    '''
+    Stop a running search and wait until its bestmove is sent
+    '''
+    def stopSearch(self):
+        if self.worker is None:
+            return
+        self.searcher.stop()
+        if self.waitForStop is not None:
+            self.waitForStop.set()
+        self.worker.join()
+        self.worker = None
+        self.searcher = None
+        self.pondering = False
+
+
+if __name__ == '__main__':
+    UsiServer().run()
@@ -1,21 +1,53 @@
 import pygame as p
 import ShogiEngine
 import AIMoveFinder
+import BackgroundSearch
 
 width = height = 760    #Shogi board height and width
 dimension = 9   #Shogi board dimensions
 sq_size = height//dimension     #Square size
+handColumns = 2     #Columns of the side panel showing the pieces in hand, black's at the top and white's at the bottom
+handRows = 4    #Rows of each hand, the middle row of the panel stays empty
 max_fps = 15    #For animation
+ponder = True   #Search the reply to the expected human move while the human thinks
 
 IMAGES = {}
+SURFACES = {}   #Board background and square overlays, rendered once
+FONTS = {}      #Fonts by size and weight, SysFont is slow to look up
+#Overlay color and alpha of every kind of highlighted square, None alpha covers the square
+HIGHLIGHTS = {'selected': ('blue', 150), 'move': ('violet', 150), 'arrival0': ('red', None), 'arrival1': ('light blue', None)}
+
+#What every square was last drawn with and the texts drawn over the board, so a frame only redraws what changed
+shownSquares = [None] * (dimension * dimension)
+shownHands = {}     #(row, col) of every hand cell: what it was last drawn with
+shownTexts = []
 
 '''
-Initialization of a dictionary of images
+Initialization of a dictionary of images, the board background and the highlight overlays
 '''
 def loadImages():
     pieces = ['wp','wB','wR','wL','wN','wS','wG','wK','wO','wH','bp','bB','bR','bL','bN','bS','bG','bK','bO','bH']
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/"+ piece + ".png"),(sq_size,sq_size))
+        IMAGES[piece] = p.transform.scale(p.image.load("images/"+ piece + ".png"),(sq_size,sq_size)).convert_alpha()
+
+    board = p.Surface((width, height)).convert()
+    board.fill(p.Color('white'))
+    colors = [p.Color("white"),p.Color("light green")]
+    for r in range(dimension):
+        for c in range(dimension):
+            board.fill(colors[((r+c)%2)], p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))    #Coloring the board squares
+    SURFACES['board'] = board
+    for kind, (color, alpha) in HIGHLIGHTS.items():
+        overlay = p.Surface((sq_size, sq_size)).convert()
+        overlay.fill(p.Color(color))
+        if alpha is not None:
+            overlay.set_alpha(alpha)
+        SURFACES[kind] = overlay
+
+def getFont(size, bold):
+    if (size, bold) not in FONTS:
+        FONTS[(size, bold)] = p.font.SysFont('Calibri', size, bold, False)
+    return FONTS[(size, bold)]
 
 
 '''
@@ -24,9 +56,10 @@ Handle user input and updating the graphics
 '''
 def main():
     p.init()
-    screen = p.display.set_mode((width,height))
+    screen = p.display.set_mode((dimension*sq_size + handColumns*sq_size, height))
     clock = p.time.Clock()
     screen.fill(p.Color('white'))
+    p.display.flip()    #Frames only update the squares they draw, the strip past the last row is shown this once
     gs = ShogiEngine.GameState()
 
     validMoves = gs.getValidMoves()     #Get valid moves
@@ -43,17 +76,24 @@ def main():
     playerOne = True    #True if human, false if AI
     playerTwo = False
 
+    search = None   #Background search of the AI move
+    pondering = None    #Background search of the AI reply to the move the human is expected to play
+
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
 
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE:   #Window contents were lost, draw everything again
+                p.display.flip()
+                forgetSquares(screen.get_rect())
+                shownTexts[:] = []
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not gameOver and humanTurn:
                     location = p.mouse.get_pos()    #(x,y) coordinates of the mouse
                     col = location[0]//sq_size
-                    row = location[1]//sq_size
+                    row = min(location[1]//sq_size, dimension - 1)
                     if sqSelected == (row,col):     #Same row and column selected
                         sqSelected = ()     #deselect
                         playerClicks = []   #clear player clicks
@@ -62,7 +102,7 @@ def main():
                         playerClicks.append(sqSelected)     #Append first and second click
 
                     if len(playerClicks) == 2:  #After second click
-                        move = ShogiEngine.Move(playerClicks[0], playerClicks[1], gs.board)
+                        move = clickedMove(gs, playerClicks[0], playerClicks[1])
                         #print(move.getShogiNotation())
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
@@ -78,7 +118,9 @@ def main():
             elif e.type == p.KEYDOWN:
                 keys = p.key.get_pressed()
                 if keys[p.K_z] and keys[p.K_LCTRL]:     #For undoing the last move
-                    if playerOne and playerTwo:
+                    aiThinking = search is not None     #The AI has not replied to the last move yet
+                    search = pondering = cancelSearches(search, pondering)
+                    if (playerOne and playerTwo) or aiThinking:
                         gs.undoMove()
                         moveMade = True
                         animate = False
@@ -91,6 +133,7 @@ def main():
                         gameOver = False
 
                 if e.key == p.K_r:
+                    search = pondering = cancelSearches(search, pondering)
                     gs = ShogiEngine.GameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
@@ -99,116 +142,261 @@ def main():
                     animate = False
                     gameOver = False
 
-        #AI move using algorithm
-        if not gameOver and not humanTurn:
-            AIMove = AIMoveFinder.findBestMoveAlphaBetaPruning(gs, validMoves)
-            # if AIMove is None:
-            #     AIMove = AIMoveFinder.findRandomMove(validMoves)
-            # print(AIMove)
-            gs.makeMove(AIMove)
-            moveMade = True
-            animate = True
+        #AI move, searched in the background so the window keeps drawing and handling events
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)    #An undo or restart may have changed the side to move
+        if not gameOver and not humanTurn and validMoves:
+            if search is None:
+                if pondering is not None and pondering.matches(gs):     #The human played the expected move
+                    search = pondering
+                else:
+                    cancelSearches(pondering)
+                    search = BackgroundSearch.SearchHandle(gs, maxDepth=AIMoveFinder.DEPTH, randomize=True)  #Randomized to get first move variation
+                pondering = None
+            elif search.isDone():
+                result = search.result
+                search = None
+                AIMove = next(move for move in validMoves if move.moveId == result.bestMove.moveId)
+                gs.makeMove(AIMove)
+                moveMade = True
+                animate = True
+                humanNext = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+                if ponder and humanNext and len(result.pv) > 1:
+                    pondering = BackgroundSearch.ponder(gs, result.pv[1], maxDepth=AIMoveFinder.DEPTH, randomize=True)
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                animateMove(gs.moveLog[-1], screen, gs.squares, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)
+        texts = []      #(text, status line) drawn over the board
+        if search is not None:
+            texts.append((progressText('Thinking', search), True))
+        elif pondering is not None and not pondering.isDone():     #A finished ponder search is kept for its result only
+            texts.append((progressText('Pondering', pondering), True))
 
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen, 'Black wins by checkmate!')
+                texts.append(('Black wins by checkmate!', False))
             else:
-                drawText(screen, 'White wins by checkmate!')
+                texts.append(('White wins by checkmate!', False))
 
         elif gs.staleMate:
             if gs.whiteToMove:
-                drawText(screen, 'Black wins by stalemate!')
+                texts.append(('Black wins by stalemate!', False))
+            else:
+                texts.append(('White wins by stalemate!', False))
+
+        elif gs.repetitionCount() >= ShogiEngine.SENNICHITE_COUNT:     #Same position four times
+            gameOver = True
+            state = gs.repetition()
+            if state == ShogiEngine.SENNICHITE:
+                texts.append(('Draw by repetition!', False))
+            elif (state == ShogiEngine.PERPETUAL_CHECK_WIN) == gs.whiteToMove:
+                texts.append(('White wins, black gave perpetual check!', False))
             else:
-                drawText(screen, 'White wins by stalemate!')
+                texts.append(('Black wins, white gave perpetual check!', False))
 
+        #Only the squares and texts that changed are drawn and sent to the display
+        p.display.update(drawGameState(screen, gs, validMoves, sqSelected, texts))
         clock.tick(max_fps)
-        p.display.flip()
 
 
 
 '''
-Highlights piece moves
+Hand cell at (row, col) of the side panel as (color, piece type), color 1 for white and 0 for black, or None
 '''
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def handCell(row, col):
+    if col < dimension:
+        return None
+    color = 0 if row < handRows else 1
+    index = 2 * (row if color == 0 else dimension - 1 - row) + col - dimension
+    if row == handRows or index >= len(ShogiEngine.handPieces):
+        return None
+    return color, ShogiEngine.handPieces[index]
+
+'''
+Move asked for by two clicks: a drop when the first is on a piece in the hand of the player to move,
+otherwise a move between two board squares. None when the clicks do not make a move
+'''
+def clickedMove(gs, first, second):
+    if second[1] >= dimension:
+        return None
+    cell = handCell(*first)
+    if cell is not None:
+        color, piece = cell
+        if color != gs.whiteToMove or gs.hands[color][piece] == 0:
+            return None
+        return ShogiEngine.Move.drop(piece if color else -piece, second[0]*dimension + second[1])
+    if first[1] >= dimension:
+        return None
+    return ShogiEngine.Move.fromRowCol(first, second, gs.squares)
+
+'''
+Highlights piece moves: {square: kind of highlight} for the selected piece and the squares it can move to
+'''
+def highlightSquares(gs, validMoves, sqSelected):
+    highlights = {}
     if sqSelected != ():
         r, c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):  #A piece that can be moved
-            #Highlight selected squares
-            s = p.Surface((sq_size, sq_size))
-            s.set_alpha(150)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c*sq_size, r*sq_size))
-            #Highlight moves from that square
-            s.fill(p.Color('violet'))
+        cell = handCell(r, c)
+        if cell is not None:
+            if cell[0] == gs.whiteToMove:   #Piece in hand, highlight where it can be dropped
+                for move in validMoves:
+                    if move.start == ShogiEngine.DROP + cell[1]:
+                        highlights[move.end] = 'move'
+        elif c < dimension and gs.squares[r*dimension + c] * (1 if gs.whiteToMove else -1) > 0:  #A piece that can be moved
+            highlights[r*dimension + c] = 'selected'
             for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol*sq_size,move.endRow*sq_size))
-
+                if move.start == r*dimension + c:
+                    highlights[move.end] = 'move'
+    return highlights
 
 
 '''
-Functions for graphics in the game
+Functions for graphics in the game.
+Draws the squares whose piece or highlight changed since the last frame, and the (text, status line) texts over the board
+when they changed or were drawn over. Returns the rectangles of the screen that need updating
 '''
-def drawGameState(screen, gs, validMoves, sqSelected):
-    drawBoard(screen)   #draw squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen,gs.board)     #draw pieces on the board
+def drawGameState(screen, gs, validMoves, sqSelected, texts=()):
+    highlights = highlightSquares(gs, validMoves, sqSelected)
+    states = [(ShogiEngine.pieceNames[piece], highlights.get(sq)) for sq, piece in enumerate(gs.squares)]
+    textsChanged = list(texts) != [(text, status) for text, status, rect in shownTexts]
+    if textsChanged:
+        for text, status, rect in shownTexts:   #Squares under the old texts are drawn again to erase them
+            forgetSquares(rect)
+    rects = drawSquares(screen, states) + drawHands(screen, gs, sqSelected)
+    if textsChanged or any(rect.collidelist(rects) != -1 for text, status, rect in shownTexts):
+        shownTexts[:] = [(text, status, drawText(screen, text, status)) for text, status in texts]
+        rects += [rect for text, status, rect in shownTexts]
+    return rects
 
+'''
+Draws every square whose (piece name, highlight) state differs from what it was last drawn with
+'''
+def drawSquares(screen, states):
+    rects = []
+    background = SURFACES['board']
+    for sq, state in enumerate(states):
+        if state == shownSquares[sq]:
+            continue
+        shownSquares[sq] = state
+        r, c = divmod(sq, dimension)
+        rect = p.Rect(c*sq_size, r*sq_size, sq_size, sq_size)
+        piece, highlight = state
+        screen.blit(background, rect, rect)
+        if highlight is not None:
+            screen.blit(SURFACES[highlight], rect)
+        if piece != '--':
+            #Show the pieces in the board
+            screen.blit(IMAGES[piece], rect)
+        rects.append(rect)
+    return rects
 
-def drawBoard(screen):
-    colors = [p.Color("white"),p.Color("light green")]
-    for r in range(dimension):
-        for c in range(dimension):
-            color = colors[((r+c)%2)]   #Coloring the board squares
-            p.draw.rect(screen,color,p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
+'''
+Draws the pieces in hand with their counts in the side panel, every cell only when its piece, count or highlight changed
+'''
+def drawHands(screen, gs, sqSelected):
+    rects = []
+    for row in range(dimension):
+        for col in range(dimension, dimension + handColumns):
+            cell = handCell(row, col)
+            state = None
+            if cell is not None:
+                color, piece = cell
+                count = gs.hands[color][piece]
+                selected = (row, col) == sqSelected and count > 0 and color == gs.whiteToMove
+                state = (ShogiEngine.pieceNames[piece if color else -piece], count, selected)
+            if shownHands.get((row, col), ()) == state:
+                continue
+            shownHands[(row, col)] = state
+            rect = p.Rect(col*sq_size, row*sq_size, sq_size, sq_size)
+            screen.fill(p.Color('white'), rect)
+            if state is not None and state[1] > 0:
+                name, count, selected = state
+                if selected:
+                    screen.blit(SURFACES['selected'], rect)
+                screen.blit(IMAGES[name], rect)
+                if count > 1:
+                    textObject = getFont(20, True).render(str(count), 0, p.Color('Black'))
+                    screen.blit(textObject, textObject.get_rect(bottomright=(rect.right - 2, rect.bottom - 2)))
+            rects.append(rect)
+    return rects
 
+'''
+Makes the squares and hand cells under rect draw again on the next frame
+'''
+def forgetSquares(rect):
+    for r in range(max(rect.top // sq_size, 0), min((rect.bottom - 1) // sq_size + 1, dimension)):
+        for c in range(max(rect.left // sq_size, 0), min((rect.right - 1) // sq_size + 1, dimension + handColumns)):
+            if c < dimension:
+                shownSquares[r*dimension + c] = None
+            else:
+                shownHands.pop((r, c), None)
 
-def drawPieces(screen, board):
-    for r in range(dimension):
-        for c in range(dimension):
-            piece = board[r][c]
-            if piece!= '--':
-                #Show the pieces in the board
-                screen.blit(IMAGES[piece], p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
+'''
+Text over the board, the status line of a search along the bottom and anything else in the middle. Returns its rectangle
+'''
+def drawText(screen, text, status=False):
+    if status:      #What a search is thinking about
+        textObject = getFont(20, False).render(text, 0, p.Color('Black'))
+        textLocation = textObject.get_rect(bottomleft=(4, height - 4))
+    else:       #When the game ends with checkmate or stalemate
+        textObject = getFont(32, True).render(text, 0, p.Color('Black'))
+        textLocation = textObject.get_rect(center=(width // 2, height // 2))
+    screen.blit(textObject, textLocation)
+    return textLocation
 
+'''
+Depth, best line and nodes of a running search, shown along the bottom of the board
+'''
+def progressText(label, handle):
+    depth, pv, score, nodes = handle.progress()
+    return '%s  depth %d  %s  nodes %d' % (label, depth, ' '.join(move.getShogiNotation() for move in pv[:6]), nodes)
 
-def drawText(screen, text):     #When the game ends with checkmate or stalemate
-    font = p.font.SysFont('Calibri', 32, True, False)
-    textObject = font.render(text, 0, p.Color('Black'))
-    textLocation = p.Rect(0, 0, height, width).move(width/2 - textObject.get_width()/2, height/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
+'''
+Stop the given searches, None entries are skipped. Returns None to clear the caller's handles
+'''
+def cancelSearches(*handles):
+    for handle in handles:
+        if handle is not None:
+            handle.cancel()
+    return None
 
-def animateMove(move, screen, board, clock):
-    colors = [p.Color("red"),p.Color("light blue")]
+'''
+Slides the moved piece to its end square. Every frame only redraws the squares the piece covered in the frame before,
+the end square shows the captured piece on a solid color until the moving piece arrives
+'''
+def animateMove(move, screen, squares, clock):
+    if move.isDrop:     #Dropped pieces come from the hand, which is not on the board
+        return
     dr = move.endRow - move.startRow
     dc = move.endCol - move.startCol
     framesPerSquare = 10
     frameCount = (abs(dr)+abs(dc)) * framesPerSquare
+    states = [(ShogiEngine.pieceNames[piece], None) for piece in squares]
+    states[move.end] = (move.pieceCaptured, 'arrival%d' % ((move.endRow + move.endCol)%2))
+    image = IMAGES[move.pieceMoved]
+    pieceRect = None
     for frame in range(frameCount + 1):
         r, c = (move.startRow + dr * frame/frameCount, move.startCol + dc*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        #Erase piece from its initial space
-        color = colors[(move.endRow + move.endCol)%2]
-        endSquare = p.Rect(move.endCol*sq_size,move.endRow*sq_size,sq_size,sq_size)
-        p.draw.rect(screen, color, endSquare)
-        #draw captured piece into rectangle
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceCaptured],endSquare)
+        rects = []
+        if pieceRect is not None:
+            forgetSquares(pieceRect)    #Erase the piece where it was drawn last frame
+            rects.append(pieceRect)
+        rects += drawSquares(screen, states)
         #Draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*sq_size, r*sq_size,sq_size,sq_size))
-        p.display.flip()
+        pieceRect = p.Rect(round(c*sq_size), round(r*sq_size), sq_size, sq_size)
+        screen.blit(image, pieceRect)
+        rects.append(pieceRect)
+        p.display.update(rects)
         clock.tick(60)
+    forgetSquares(pieceRect)
+    for text, status, rect in shownTexts:   #Texts the animation drew over
+        forgetSquares(rect)
+    shownTexts[:] = []
 
-main()
-
+if __name__ == '__main__':
+    main()